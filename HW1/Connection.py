@@ -3,4 +3,5 @@ class Connection:
         self.socket = socket
         self.read_buffer = ''
         self.status = 'greeting'
-        self.username = None
\ No newline at end of file
+        self.username = None
+        self.job = None
\ No newline at end of file
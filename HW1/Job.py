@@ -0,0 +1,30 @@
+class Job:
+    def __init__(self, key, opcode, steps):
+        self.key = key              # Normalized request: identical requests share one job
+        self.opcode = opcode
+        self.steps = steps          # Generator running the command, returns the response
+        self.waiters = {}           # Connection waiting for the response -> its time.monotonic() deadline
+        self.deadline = None        # Earliest deadline among the waiters
+        self.cpu_time = 0.0         # Seconds spent running steps so far
+
+    @property
+    def cancelled(self):
+        # Nobody is waiting for the answer anymore
+        return not self.waiters
+
+    def add_waiter(self, connection, deadline):
+        self.waiters[connection] = deadline
+        if self.deadline is None or deadline < self.deadline:
+            self.deadline = deadline
+
+    def remove_waiter(self, connection):
+        self.waiters.pop(connection, None)
+        self.deadline = min(self.waiters.values(), default=None)
+
+    def expired_waiters(self, now):
+        # Removes and returns the waiters whose deadline has passed
+        expired = [connection for connection, deadline in self.waiters.items() if deadline < now]
+        for connection in expired:
+            del self.waiters[connection]
+        self.deadline = min(self.waiters.values(), default=None)
+        return expired
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 import re
 import sys
 import socket
@@ -10,6 +11,10 @@ WELCOME_MESSAGE = "Welcome! Please log in."
 CALCULATE_COMMAND_REGEX = "^calculate: (-?\d{1,9}) (\^|\/|\*|-|\+) (-?\d{1,9})$"
 MAX_COMMAND_REGEX = "^max: \((-?\d+)(?: (-?\d+))*\)$"
 FACTORS_COMMAND_REGEX = "^factors: (-?\d+)$"
+IS_PRIME_COMMAND_REGEX = "^is_prime: (-?\d+)$"
+MODPOW_COMMAND_REGEX = "^modpow: (-?\d+) (-?\d+) (\d+)$"
+GCD_COMMAND_REGEX = "^gcd: \((-?\d+)(?: (-?\d+))*\)$"
+LCM_COMMAND_REGEX = "^lcm: \((-?\d+)(?: (-?\d+))*\)$"
 QUIT = "quit"
 FAILED_LOGIN_MESSAGE = "Failed to login."
 FAILURE_PACKET = "N"
@@ -92,6 +97,23 @@ def execute_command(client_socket: socket.socket):
         command_parsed = command.replace("factors: ", "")
         client_socket.sendall(f"3 {command_parsed}{MESSAGE_SEP}".encode())
 
+    elif re.match(IS_PRIME_COMMAND_REGEX, command):
+        command_parsed = command.replace("is_prime: ", "")
+        client_socket.sendall(f"5 {command_parsed}{MESSAGE_SEP}".encode())
+
+    elif re.match(MODPOW_COMMAND_REGEX, command):
+        command_info_str = " ".join(re.findall(MODPOW_COMMAND_REGEX, command)[0])
+        client_socket.sendall(f"6 {command_info_str}{MESSAGE_SEP}".encode())
+
+    # gcd and lcm take a list in the same format as max
+    elif re.match(GCD_COMMAND_REGEX, command):
+        command_parsed = command.replace("gcd: (", "").rstrip(")").replace(" ", ",")
+        client_socket.sendall(f"7 {command_parsed}{MESSAGE_SEP}".encode())
+
+    elif re.match(LCM_COMMAND_REGEX, command):
+        command_parsed = command.replace("lcm: (", "").rstrip(")").replace(" ", ",")
+        client_socket.sendall(f"8 {command_parsed}{MESSAGE_SEP}".encode())
+
     else:
         print("Got invalid command from user\n Exiting...")
         return QUIT
@@ -109,12 +131,17 @@ def main():
     hostname = sys.argv[1] if len(sys.argv) > 1 else default_hostname
     port = int(sys.argv[2]) if len(sys.argv) > 2 else default_port
 
-    # Print the results
-    print(f"Connecting to {hostname} on port {port}")
+    # A path instead of a hostname means the server's Unix domain socket on this host
+    if os.sep in hostname:
+        family, address = socket.AF_UNIX, hostname
+        print(f"Connecting to Unix socket {hostname}")
+    else:
+        family, address = socket.AF_INET, (hostname, port)
+        print(f"Connecting to {hostname} on port {port}")
 
-    with socket.socket() as sock:
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
         try:
-            sock.connect((hostname, port))
+            sock.connect(address)
             auth_successful = False
 
             while not auth_successful:
@@ -0,0 +1,25 @@
+"""
+Logging for the numbers server and proxy.
+
+The implementation lives in common/structured_log.py and is shared with the
+HW3 cman server; this module only makes it importable when a numbers script
+runs from HW1/. The server logs as 'numbers_server', the proxy as
+'numbers_proxy'.
+
+Usage:
+    setup_logging('INFO')
+    log = get_logger('numbers_server')
+    log.info("client connected", addr=addr)
+    log.debug("bad request", sample=100, data=data)
+"""
+
+import os
+import sys
+
+# common/ sits next to HW1/. Appended, not prepended: the repo root also holds
+# the original numbers_server.py and Connection.py, which must not shadow HW1's
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.structured_log import get_logger, setup_logging, shutdown_logging
+
+__all__ = ['get_logger', 'setup_logging', 'shutdown_logging']
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""
+Drives numbers_server past its capacity and checks that admission control
+keeps the latency of admitted requests bounded.
+
+Many concurrent clients repeatedly ask for the factors of large primes, far
+more work than one server process can keep up with. The server sheds the
+excess with "error: server busy"; the benchmark reports the latency of the
+requests that were admitted and exits non-zero when their p99 goes beyond
+twice the wait budget. A cheap-command probe runs alongside to show those
+are never refused.
+
+    ./numbers_overload_benchmark.py users.txt --clients 32 --budget 0.5
+
+--quick is a short run with a relaxed bound, quick enough to check for
+admission control regressions after every change:
+
+    ./numbers_overload_benchmark.py users.txt --quick
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+
+MESSAGE_SEP = "\\"
+BUSY_MESSAGE = b"error: server busy"
+# Primes around 10**11: a few tens of milliseconds of trial division each
+PRIMES = [100000000003, 100000000019, 100000000057, 100000000063, 100000000069, 100000000073]
+# Small cofactors make every request distinct, so the server can't coalesce them, at the same cost
+MAX_COFACTOR = 300000
+
+# The estimate is made on admission, so allow one extra request's worth of slack on top of the budget
+DEFAULT_SLACK = 2
+# --quick: a short run, whose few samples make p99 noisier, so the bound is looser
+QUICK_CLIENTS = 16
+QUICK_DURATION = 3.0
+QUICK_WARMUP = 1.0
+QUICK_SLACK = 3
+
+
+def login(port, user, password):
+    for _ in range(50):
+        try:
+            sock = socket.create_connection(("127.0.0.1", port))
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    else:
+        raise RuntimeError("server did not come up")
+    sock.recv(1024)
+    sock.sendall(f"0 {user},{password}{MESSAGE_SEP}".encode())
+    sock.recv(1024)
+    return sock
+
+
+def worker(index, sock, measure_from, stop_at, admitted, rejected, lock):
+    i = 0
+    while time.monotonic() < stop_at:
+        cofactor = 1 + (i * 64 + index) % MAX_COFACTOR
+        request = f"3 {PRIMES[i % len(PRIMES)] * cofactor}{MESSAGE_SEP}".encode()
+        i += 1
+        start = time.perf_counter()
+        sock.sendall(request)
+        reply = sock.recv(1024)
+        elapsed = time.perf_counter() - start
+        busy = reply == BUSY_MESSAGE
+        # Requests issued while the server was still learning how long one takes aren't counted
+        if time.monotonic() - elapsed >= measure_from:
+            with lock:
+                (rejected if busy else admitted).append(elapsed)
+        if busy:
+            # Clients back off briefly after a busy reply instead of hammering
+            time.sleep(0.01)
+    sock.close()
+
+
+def cheap_probe(sock, stop_at, latencies):
+    while time.monotonic() < stop_at:
+        start = time.perf_counter()
+        sock.sendall(f"1 2 + 2{MESSAGE_SEP}".encode())
+        if sock.recv(1024) == BUSY_MESSAGE:
+            raise RuntimeError("cheap command was refused")
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.05)
+    sock.close()
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))] if samples else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overload numbers_server and check admitted request latency")
+    parser.add_argument("users_file", help="Users file passed to the server; the first user is used to log in.")
+    parser.add_argument("-p", "--port", type=int, default=13380, help="TCP port for the benchmark server.")
+    parser.add_argument("-c", "--clients", type=int, default=32, help="Concurrent factoring clients.")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="Seconds to keep the load on.")
+    parser.add_argument("-w", "--warmup", type=float, default=2.0,
+                        help="Seconds of load before measuring, while the server's service time estimates settle.")
+    parser.add_argument("-b", "--budget", type=float, default=0.5, help="Server --wait-budget in seconds.")
+    parser.add_argument("--quick", action="store_true",
+                        help=f"Regression check: {QUICK_CLIENTS} clients for {QUICK_DURATION:g}s after "
+                             f"{QUICK_WARMUP:g}s of warmup, p99 bound of {QUICK_SLACK:g}x the budget.")
+    args = parser.parse_args()
+    slack = DEFAULT_SLACK
+    if args.quick:
+        args.clients, args.duration, args.warmup = QUICK_CLIENTS, QUICK_DURATION, QUICK_WARMUP
+        slack = QUICK_SLACK
+
+    with open(args.users_file) as f:
+        user, password = f.readline().split()
+
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "numbers_server.py")
+    server = subprocess.Popen([sys.executable, server_path, args.users_file, str(args.port),
+                               "--wait-budget", str(args.budget), "--deadline", "3=60", "--log-level", "ERROR"])
+    admitted, rejected, cheap = [], [], []
+    lock = threading.Lock()
+    try:
+        # Log everyone in one at a time first: the server's listen backlog is small
+        sockets = [login(args.port, user, password) for _ in range(args.clients + 1)]
+        measure_from = time.monotonic() + args.warmup
+        stop_at = measure_from + args.duration
+        threads = [threading.Thread(target=worker, args=(index, sock, measure_from, stop_at, admitted, rejected, lock))
+                   for index, sock in enumerate(sockets[1:])]
+        threads.append(threading.Thread(target=cheap_probe, args=(sockets[0], stop_at, cheap)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    total = len(admitted) + len(rejected)
+    p99 = percentile(admitted, 99)
+    print(f"requests: {total}, admitted: {len(admitted)}, busy: {len(rejected)} "
+          f"({len(rejected) / max(total, 1):.0%})")
+    print(f"admitted latency: p50={percentile(admitted, 50) * 1e3:.1f}ms p99={p99 * 1e3:.1f}ms "
+          f"max={max(admitted, default=0) * 1e3:.1f}ms")
+    print(f"busy reply latency: p99={percentile(rejected, 99) * 1e3:.1f}ms")
+    print(f"cheap command latency: p99={percentile(cheap, 99) * 1e3:.1f}ms over {len(cheap)} requests")
+
+    if not args.budget:
+        return
+    if not admitted or not rejected:
+        # Either nothing got through or the server was never pushed past capacity: nothing was checked
+        print(f"FAIL: expected both admitted and busy replies, got {len(admitted)} and {len(rejected)}")
+        sys.exit(1)
+    limit = args.budget * slack
+    if p99 > limit:
+        print(f"FAIL: admitted p99 {p99 * 1e3:.1f}ms exceeds {limit * 1e3:.0f}ms")
+        sys.exit(1)
+    print(f"OK: admitted p99 stays under {limit * 1e3:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+
+"""
+Offline latency analyzer for numbers protocol captures.
+
+Streams a classic libpcap file record by record, reassembles the TCP streams
+that talk to the numbers server and decodes the protocol on top of them:
+the server greeting, '0' login, the '1'-'3' and '5'-'8' commands and '4' quit.
+Every request is paired with the server response that follows it, and the
+analyzer reports per-opcode response time distributions, handshake to first
+command latency and the number of TCP segments each message was spread over.
+
+Memory use is bounded no matter how large the capture is: latencies go into
+fixed-size log scale histograms, finished flows are dropped on FIN/RST, idle
+flows are evicted and every per-flow buffer is capped.
+"""
+
+import sys
+import math
+import struct
+import argparse
+from collections import Counter, OrderedDict
+
+PCAP_MAGIC_MICRO = 0xA1B2C3D4
+PCAP_MAGIC_NANO = 0xA1B23C4D
+PCAPNG_MAGIC = 0x0A0D0D0A
+
+# Link layer types we know how to strip
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+IPPROTO_TCP = 6
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+MESSAGE_SEP = b'\\'
+OPCODE_NAMES = {
+    '0': 'login',
+    '1': 'calculate',
+    '2': 'max',
+    '3': 'factors',
+    '4': 'quit',
+    '5': 'is_prime',
+    '6': 'modpow',
+    '7': 'gcd',
+    '8': 'lcm',
+}
+COMMAND_OPCODES = ('1', '2', '3', '5', '6', '7', '8')
+
+# Bounds that keep memory flat on multi-GB captures
+MAX_PENDING_SEGMENTS = 64      # Out of order segments buffered per direction
+MAX_MESSAGE_BYTES = 64 * 1024  # Longer requests are truncated (only the opcode matters)
+
+PCAP_RECORD_HEADER = struct.Struct('IIII')
+
+
+class LatencyHistogram:
+    """ Fixed-size log scale histogram (1us .. ~1000s, 20 buckets per decade) """
+
+    BUCKETS_PER_DECADE = 20
+    MIN_VALUE = 1e-6
+    DECADES = 9
+
+    def __init__(self):
+        self.buckets = [0] * (self.BUCKETS_PER_DECADE * self.DECADES + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        value = max(value, 0.0)
+        index = 0
+        if value > self.MIN_VALUE:
+            index = int(math.log10(value / self.MIN_VALUE) * self.BUCKETS_PER_DECADE) + 1
+            index = min(index, len(self.buckets) - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, pct):
+        # Upper edge of the bucket holding the requested rank, clamped to the observed range
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * pct / 100.0)
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                upper = self.MIN_VALUE * 10 ** (index / self.BUCKETS_PER_DECADE)
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class HalfStream:
+    """ Reassembles one direction of a TCP connection into in-order chunks """
+
+    def __init__(self):
+        self.next_seq = None
+        self.pending = {}
+
+    def feed(self, seq, syn, timestamp, payload):
+        if syn:
+            self.next_seq = (seq + 1) & 0xFFFFFFFF
+            self.pending.clear()
+            return []
+        if not payload:
+            return []
+        if self.next_seq is None:
+            # Capture started mid-stream: trust the first segment we see
+            self.next_seq = seq
+
+        offset = (seq - self.next_seq) & 0xFFFFFFFF
+        if offset >= 2**31:
+            # Segment starts before what we already delivered: keep only the new tail
+            overlap = (self.next_seq - seq) & 0xFFFFFFFF
+            if overlap >= len(payload):
+                return []
+            payload = payload[overlap:]
+            offset = 0
+        if offset > 0:
+            if len(self.pending) < MAX_PENDING_SEGMENTS:
+                self.pending[seq] = (timestamp, payload)
+            return []
+
+        chunks = [(timestamp, payload)]
+        self.next_seq = (self.next_seq + len(payload)) & 0xFFFFFFFF
+        while self.next_seq in self.pending:
+            timestamp, payload = self.pending.pop(self.next_seq)
+            chunks.append((timestamp, payload))
+            self.next_seq = (self.next_seq + len(payload)) & 0xFFFFFFFF
+        return chunks
+
+
+class Flow:
+    """ Protocol state for a single client <-> server connection """
+
+    __slots__ = ('client', 'server', 'start_time', 'last_seen', 'closing',
+                 'request_buffer', 'request_start', 'request_segments',
+                 'outstanding', 'response_open', 'response_segments',
+                 'greeted', 'first_command_seen')
+
+    def __init__(self, timestamp):
+        self.client = HalfStream()
+        self.server = HalfStream()
+        self.start_time = None   # SYN timestamp, unknown when the capture starts mid-connection
+        self.last_seen = timestamp
+        self.closing = 0
+        self.request_buffer = bytearray()
+        self.request_start = None
+        self.request_segments = 0
+        self.outstanding = None  # (opcode, last request byte timestamp)
+        self.response_open = False
+        self.response_segments = 0
+        self.greeted = False
+        self.first_command_seen = False
+
+
+class Analyzer:
+    def __init__(self, server_port, idle_timeout, max_flows):
+        self.server_port = server_port
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.flows = OrderedDict()
+
+        self.response_times = {}
+        self.greeting_latency = LatencyHistogram()
+        self.first_command_latency = LatencyHistogram()
+        self.request_segments = {}
+        self.response_segments = Counter()
+        self.unanswered = Counter()
+        self.packets = 0
+        self.connections = 0
+        self.evicted = 0
+
+    # ---- Packet level ----
+
+    def handle_tcp(self, timestamp, src, dst, segment):
+        if len(segment) < 20:
+            return
+        src_port, dst_port, seq = struct.unpack_from('!HHI', segment)
+        data_offset = (segment[12] >> 4) * 4
+        flags = segment[13]
+        payload = segment[data_offset:]
+
+        if dst_port == self.server_port:
+            key, from_client = (src, src_port, dst), True
+        elif src_port == self.server_port:
+            key, from_client = (dst, dst_port, src), False
+        else:
+            return
+        self.packets += 1
+
+        flow = self.flows.get(key)
+        if flow is None:
+            if flags & (TCP_RST | TCP_FIN) and not payload:
+                return
+            flow = Flow(timestamp)
+            self.flows[key] = flow
+            self.connections += 1
+            if len(self.flows) > self.max_flows:
+                self.evict(self.flows.popitem(last=False)[1])
+        else:
+            self.flows.move_to_end(key)
+        flow.last_seen = timestamp
+
+        half = flow.client if from_client else flow.server
+        syn = bool(flags & TCP_SYN)
+        if syn and from_client:
+            flow.start_time = timestamp
+        for chunk_time, chunk in half.feed(seq, syn, timestamp, payload):
+            if from_client:
+                self.client_data(flow, chunk_time, chunk)
+            else:
+                self.server_data(flow, chunk_time)
+
+        if flags & TCP_RST:
+            self.finish(key)
+        elif flags & TCP_FIN:
+            flow.closing += 1
+            if flow.closing >= 2:
+                self.finish(key)
+
+    # ---- Protocol level ----
+
+    def client_data(self, flow, timestamp, chunk):
+        self.close_response(flow)
+        position = 0
+        while position < len(chunk):
+            if flow.request_start is None:
+                flow.request_start = timestamp
+                flow.request_segments = 0
+            if position == 0 or flow.request_segments == 0:
+                flow.request_segments += 1
+            end = chunk.find(MESSAGE_SEP, position)
+            if end == -1:
+                room = MAX_MESSAGE_BYTES - len(flow.request_buffer)
+                flow.request_buffer += chunk[position:position + max(room, 0)]
+                return
+            flow.request_buffer += chunk[position:end]
+            self.request_complete(flow, timestamp)
+            position = end + 1
+
+    def request_complete(self, flow, timestamp):
+        opcode = chr(flow.request_buffer[0]) if flow.request_buffer else '?'
+        self.request_segments.setdefault(opcode, Counter())[flow.request_segments] += 1
+        if flow.outstanding is not None:
+            self.unanswered[flow.outstanding[0]] += 1
+        if opcode in COMMAND_OPCODES and not flow.first_command_seen:
+            flow.first_command_seen = True
+            if flow.start_time is not None:
+                self.first_command_latency.add(flow.request_start - flow.start_time)
+        # Quit never gets a response, the server just closes the connection
+        flow.outstanding = None if opcode == '4' else (opcode, timestamp)
+        flow.request_buffer = bytearray()
+        flow.request_start = None
+
+    def server_data(self, flow, timestamp):
+        if flow.response_open:
+            flow.response_segments += 1
+            return
+        flow.response_open = True
+        flow.response_segments = 1
+        if flow.outstanding is not None:
+            opcode, requested_at = flow.outstanding
+            histogram = self.response_times.setdefault(opcode, LatencyHistogram())
+            histogram.add(timestamp - requested_at)
+            flow.outstanding = None
+        elif not flow.greeted and flow.start_time is not None:
+            self.greeting_latency.add(timestamp - flow.start_time)
+        flow.greeted = True
+
+    def close_response(self, flow):
+        if flow.response_open:
+            self.response_segments[flow.response_segments] += 1
+            flow.response_open = False
+
+    def finish(self, key):
+        flow = self.flows.pop(key, None)
+        if flow is not None:
+            self.close_response(flow)
+            if flow.outstanding is not None:
+                self.unanswered[flow.outstanding[0]] += 1
+
+    def evict(self, flow):
+        self.evicted += 1
+        self.close_response(flow)
+
+    def evict_idle(self, now):
+        while self.flows:
+            key, flow = next(iter(self.flows.items()))
+            if now - flow.last_seen < self.idle_timeout:
+                break
+            del self.flows[key]
+            self.evict(flow)
+
+    def close_all(self):
+        for key in list(self.flows):
+            self.finish(key)
+
+
+def read_pcap(stream):
+    """ Yields (linktype, timestamp, packet bytes) for every record, one record in memory at a time """
+    header = stream.read(24)
+    if len(header) < 24:
+        raise ValueError("file is too short to be a pcap capture")
+    magic = struct.unpack('<I', header[:4])[0]
+    if magic == PCAPNG_MAGIC:
+        raise ValueError("pcapng is not supported, convert with: editcap -F pcap in.pcapng out.pcap")
+    for endian in ('<', '>'):
+        magic = struct.unpack(endian + 'I', header[:4])[0]
+        if magic in (PCAP_MAGIC_MICRO, PCAP_MAGIC_NANO):
+            break
+    else:
+        raise ValueError("not a pcap capture (bad magic number)")
+    divisor = 1e9 if magic == PCAP_MAGIC_NANO else 1e6
+    linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0FFFFFFF
+    record_header = struct.Struct(endian + PCAP_RECORD_HEADER.format)
+
+    while True:
+        raw = stream.read(record_header.size)
+        if len(raw) < record_header.size:
+            return
+        seconds, fraction, captured_length, _ = record_header.unpack(raw)
+        packet = stream.read(captured_length)
+        if len(packet) < captured_length:
+            return
+        yield linktype, seconds + fraction / divisor, packet
+
+
+def strip_link_layer(linktype, packet):
+    """ Returns (ethertype, network layer bytes) or (None, None) for frames we don't decode """
+    if linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        family = struct.unpack('<I', packet[:4])[0]
+        if family > 0xFFFF:
+            family = struct.unpack('>I', packet[:4])[0]
+        if family == 2:
+            return ETHERTYPE_IPV4, packet[4:]
+        if family in (10, 24, 28, 30):
+            return ETHERTYPE_IPV6, packet[4:]
+        return None, None
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 12
+        ethertype = struct.unpack_from('!H', packet, offset)[0]
+        while ethertype in ETHERTYPE_VLAN:
+            offset += 4
+            ethertype = struct.unpack_from('!H', packet, offset)[0]
+        return ethertype, packet[offset + 2:]
+    if linktype == LINKTYPE_RAW:
+        return (ETHERTYPE_IPV4 if packet[0] >> 4 == 4 else ETHERTYPE_IPV6), packet
+    if linktype == LINKTYPE_LINUX_SLL:
+        return struct.unpack_from('!H', packet, 14)[0], packet[16:]
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return struct.unpack_from('!H', packet, 0)[0], packet[20:]
+    return None, None
+
+
+def strip_network_layer(ethertype, packet):
+    """ Returns (src address, dst address, tcp segment) or None for non TCP packets """
+    if ethertype == ETHERTYPE_IPV4 and len(packet) >= 20:
+        header_length = (packet[0] & 0x0F) * 4
+        total_length = struct.unpack_from('!H', packet, 2)[0]
+        if packet[9] != IPPROTO_TCP:
+            return None
+        # Loopback captures with TSO may report a zero length
+        end = total_length if total_length else len(packet)
+        return packet[12:16], packet[16:20], packet[header_length:end]
+    if ethertype == ETHERTYPE_IPV6 and len(packet) >= 40:
+        if packet[6] != IPPROTO_TCP:
+            return None
+        payload_length = struct.unpack_from('!H', packet, 4)[0]
+        return packet[8:24], packet[24:40], packet[40:40 + payload_length]
+    return None
+
+
+def format_seconds(value):
+    if value is None:
+        return '-'
+    if value < 1e-3:
+        return f"{value * 1e6:.0f}us"
+    if value < 1:
+        return f"{value * 1e3:.2f}ms"
+    return f"{value:.3f}s"
+
+
+def format_histogram(name, histogram):
+    if not histogram.count:
+        return f"  {name:<22} n=0"
+    return (f"  {name:<22} n={histogram.count:<8} min={format_seconds(histogram.min):<9} "
+            f"p50={format_seconds(histogram.percentile(50)):<9} "
+            f"p90={format_seconds(histogram.percentile(90)):<9} "
+            f"p99={format_seconds(histogram.percentile(99)):<9} "
+            f"max={format_seconds(histogram.max):<9} mean={format_seconds(histogram.mean())}")
+
+
+def format_segments(name, counter):
+    total = sum(counter.values())
+    if not total:
+        return f"  {name:<22} n=0"
+    single = counter.get(1, 0)
+    average = sum(segments * count for segments, count in counter.items()) / total
+    return (f"  {name:<22} n={total:<8} avg={average:.2f} max={max(counter)} "
+            f"single-segment={single / total:.1%}")
+
+
+def opcode_label(opcode):
+    return f"{opcode} ({OPCODE_NAMES.get(opcode, 'unknown')})"
+
+
+def print_report(analyzer):
+    print(f"Packets on port {analyzer.server_port}: {analyzer.packets}, "
+          f"connections: {analyzer.connections}, evicted before close: {analyzer.evicted}")
+
+    print("\nServer response time per opcode (last request byte -> first response byte):")
+    for opcode in sorted(analyzer.response_times):
+        print(format_histogram(opcode_label(opcode), analyzer.response_times[opcode]))
+    if not analyzer.response_times:
+        print("  no request/response pairs found")
+
+    print("\nConnection latency:")
+    print(format_histogram("syn -> greeting", analyzer.greeting_latency))
+    print(format_histogram("syn -> first command", analyzer.first_command_latency))
+
+    print("\nSegments per message:")
+    for opcode in sorted(analyzer.request_segments):
+        print(format_segments(f"request {opcode_label(opcode)}", analyzer.request_segments[opcode]))
+    print(format_segments("server responses", analyzer.response_segments))
+
+    unanswered = {opcode: count for opcode, count in analyzer.unanswered.items() if count}
+    if unanswered:
+        print("\nRequests without a response: " +
+              ", ".join(f"{opcode_label(opcode)}={count}" for opcode, count in sorted(unanswered.items())))
+
+
+def analyze(path, server_port, idle_timeout=300.0, max_flows=100000):
+    analyzer = Analyzer(server_port, idle_timeout, max_flows)
+    next_sweep = None
+    with open(path, 'rb') as stream:
+        for linktype, timestamp, packet in read_pcap(stream):
+            try:
+                ethertype, network = strip_link_layer(linktype, packet)
+                if ethertype is None:
+                    continue
+                parsed = strip_network_layer(ethertype, network)
+                if parsed is None:
+                    continue
+                analyzer.handle_tcp(timestamp, *parsed)
+            except (struct.error, IndexError):
+                # Truncated or malformed frame (short snaplen) - skip it
+                continue
+
+            if next_sweep is None or timestamp >= next_sweep:
+                analyzer.evict_idle(timestamp)
+                next_sweep = timestamp + idle_timeout / 10
+    analyzer.close_all()
+    return analyzer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Numbers protocol latency analyzer for pcap captures")
+    parser.add_argument("pcap", help="Path to a libpcap capture file.")
+    parser.add_argument("-p", "--port", type=int, default=1337, help="Numbers server port (default: 1337).")
+    parser.add_argument("--idle-timeout", type=float, default=300.0,
+                        help="Forget flows idle for this many capture seconds (default: 300).")
+    parser.add_argument("--max-flows", type=int, default=100000,
+                        help="Maximum number of concurrently tracked flows (default: 100000).")
+    args = parser.parse_args()
+
+    try:
+        analyzer = analyze(args.pcap, args.port, args.idle_timeout, args.max_flows)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print_report(analyzer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+
+"""
+Front proxy for several numbers_server backends.
+
+The proxy speaks the numbers protocol to clients: it sends the greeting and
+checks logins against the users file itself, so clients never talk to a
+backend directly. Authenticated commands are forwarded over a small pool of
+pre-authenticated connections per backend:
+
+  * '3' (factors) is routed by consistent hash of the number, so the same
+    number always lands on the same backend and hits its warm caches.
+  * every other command is cheap and goes to the least loaded healthy backend.
+
+Backends are health checked periodically (connect + greeting). A backend that
+fails a check, refuses a connection or drops a request in flight is taken out
+of rotation and the request is retried on the next backend of the ring.
+"""
+
+import sys
+import time
+import errno
+import select
+import socket
+import bisect
+import hashlib
+import argparse
+from collections import deque
+from numbers_log import setup_logging, get_logger
+
+log = get_logger('numbers_proxy')
+
+MESSAGE_SEP = b'\\'
+WELCOME_MESSAGE = "Welcome! Please log in."
+FAILURE_PACKET = "N"
+NO_BACKEND_MESSAGE = "error: no backend available"
+VIRTUAL_NODES = 100
+RECV_SIZE = 4096
+
+
+class Backend:
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.name = f"{host}:{port}"
+        self.healthy = True
+        self.idle = []              # Authenticated connections ready for a request
+        self.connections = 0        # Open (or opening) pooled connections
+        self.active = 0             # Requests in flight on this backend
+        self.waiting = deque()      # Requests waiting for a free pooled connection
+        self.probe = None
+        self.next_check = 0.0
+
+    def load(self):
+        return self.active + len(self.waiting)
+
+
+class BackendConnection:
+    def __init__(self, backend, sock):
+        self.backend = backend
+        self.socket = sock
+        self.status = 'connecting'  # connecting -> greeting -> login -> idle <-> busy
+        self.out_buffer = b''
+        self.request = None
+
+
+class HealthProbe:
+    def __init__(self, backend, sock, deadline):
+        self.backend = backend
+        self.socket = sock
+        self.status = 'connecting'  # connecting -> greeting
+        self.deadline = deadline
+        self.out_buffer = b''
+
+
+class ProxyClient:
+    def __init__(self, sock):
+        self.socket = sock
+        self.status = 'auth'        # auth -> on <-> waiting
+        self.read_buffer = b''
+        self.out_buffer = WELCOME_MESSAGE.encode()
+        self.username = None
+        self.request = None
+
+
+class Request:
+    def __init__(self, client, data, key):
+        self.client = client
+        self.data = data
+        self.key = key              # Consistent hash key, None for least-loaded routing
+        self.tried = set()
+
+
+def main():
+    global users_credentials, backend_credentials, backends, ring, endpoints, pool_size
+    args = parse_command_line_args()
+    setup_logging(args.log_level)
+
+    users_credentials = fetch_users_credentials_from_file(args.users_file)
+    backend_user = args.backend_user or next(iter(users_credentials), None)
+    if backend_user not in users_credentials:
+        log.error("backend user is not in the users file", user=backend_user)
+        sys.exit(1)
+    backend_credentials = f"0 {backend_user},{users_credentials[backend_user]}".encode() + MESSAGE_SEP
+    pool_size = args.pool_size
+
+    backends = [Backend(*parse_backend_address(address)) for address in args.backend]
+    ring = build_ring(backends)
+    endpoints = {}
+
+    try:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('', args.port))
+        listener.listen(128)
+        listener.setblocking(False)
+    except socket.error as e:
+        log.error("could not start proxy", port=args.port, error=e)
+        sys.exit(1)
+    log.info("proxy started", port=args.port, backends=','.join(backend.name for backend in backends))
+
+    while True:
+        run_health_checks(args.health_interval, args.health_timeout)
+
+        readable = [listener] + [endpoint.socket for endpoint in endpoints.values() if wants_read(endpoint)]
+        writable = [endpoint.socket for endpoint in endpoints.values()
+                    if endpoint.out_buffer or endpoint.status == 'connecting']
+        try:
+            readables, writables, _ = select.select(readable, writable, [], 0.1)
+        except (OSError, ValueError) as e:
+            log.error("select error", error=e)
+            continue
+
+        for sock in writables:
+            endpoint = endpoints.get(sock.fileno())
+            if endpoint is not None:
+                handle_writable(endpoint)
+
+        for sock in readables:
+            if sock is listener:
+                accept_clients(listener)
+                continue
+            endpoint = endpoints.get(sock.fileno())
+            if endpoint is not None:
+                handle_readable(endpoint)
+
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description="Numbers protocol front proxy")
+    parser.add_argument("users_file", help="Path to the user file used to authenticate clients.")
+    parser.add_argument("port", type=int, nargs='?', default=1337, help="Port to listen on (default is 1337).")
+    parser.add_argument("-b", "--backend", action="append", required=True, metavar="HOST:PORT",
+                        help="A numbers_server backend. Repeat for every backend.")
+    parser.add_argument("--backend-user", help="User the proxy logs into backends as (default: first user in the file).")
+    parser.add_argument("--pool-size", type=int, default=8, help="Maximum connections per backend (default: 8).")
+    parser.add_argument("--health-interval", type=float, default=2.0, help="Seconds between health checks (default: 2).")
+    parser.add_argument("--health-timeout", type=float, default=1.0, help="Seconds a health check may take (default: 1).")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Minimum level of log records to write (default: INFO).")
+    return parser.parse_args()
+
+
+def parse_backend_address(address):
+    host, _, port = address.rpartition(':')
+    try:
+        return host or 'localhost', int(port)
+    except ValueError:
+        log.error("invalid backend address", address=address)
+        sys.exit(1)
+
+
+def fetch_users_credentials_from_file(file):
+    # Read user credentials from a file and store them in a dictionary
+    users = {}
+    try:
+        with open(file, 'r') as f:
+            for line in f:
+                if line.strip():
+                    username, password = line.split()
+                    users[username] = password
+        return users
+    except FileNotFoundError:
+        log.error("users file not found", path=file)
+        sys.exit(1)
+    except ValueError:
+        log.error("invalid users file format", path=file)
+        sys.exit(1)
+
+
+# ---- Routing ----
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+def build_ring(backends):
+    # Every backend owns VIRTUAL_NODES points on the ring so keys spread evenly
+    points = [(ring_hash(f"{backend.name}#{i}"), backend) for backend in backends for i in range(VIRTUAL_NODES)]
+    points.sort(key=lambda point: point[0])
+    return [point[0] for point in points], [point[1] for point in points]
+
+
+def pick_backend(request):
+    candidates = [backend for backend in backends if backend.healthy and backend not in request.tried]
+    if not candidates:
+        return None
+    if request.key is None:
+        return min(candidates, key=Backend.load)
+
+    # Walk the ring clockwise from the key's position to the first usable backend
+    hashes, owners = ring
+    start = bisect.bisect(hashes, ring_hash(request.key))
+    for i in range(len(owners)):
+        backend = owners[(start + i) % len(owners)]
+        if backend.healthy and backend not in request.tried:
+            return backend
+    return None
+
+
+def routing_key(text):
+    # Factors requests hash by the normalized number; everything else is least-loaded
+    if text.startswith('3'):
+        return str(int(text[2:]))
+    return None
+
+
+def is_valid_command(text):
+    # Same checks numbers_server applies, so backends never drop a connection over bad input
+    try:
+        if text.startswith('1 '):
+            num1, op, num2 = text[2:].split()
+            int(num1), int(num2)
+            return True
+        if text.startswith('2 '):
+            [int(number) for number in text[2:].split(',')]
+            return True
+        if text.startswith('3 ') or text.startswith('5 '):
+            int(text[2:])
+            return True
+        if text.startswith('6 '):
+            base, exponent, modulus = text[2:].split()
+            int(base), int(exponent), int(modulus)
+            return True
+        if text.startswith('7 ') or text.startswith('8 '):
+            [int(number) for number in text[2:].split(',')]
+            return True
+    except ValueError:
+        return False
+    return False
+
+
+def dispatch(request):
+    backend = pick_backend(request)
+    if backend is None:
+        finish_request(request, NO_BACKEND_MESSAGE)
+        return
+    request.tried.add(backend)
+    backend.active += 1
+    if backend.idle:
+        send_request(backend.idle.pop(), request)
+        return
+    backend.waiting.append(request)
+    if backend.connections < pool_size:
+        open_backend_connection(backend)
+
+
+def send_request(connection, request):
+    connection.status = 'busy'
+    connection.request = request
+    connection.out_buffer += request.data
+
+
+def finish_request(request, response):
+    client = request.client
+    if client.socket.fileno() == -1:
+        return
+    client.request = None
+    client.status = 'on'
+    client.out_buffer += response.encode() if isinstance(response, str) else response
+
+
+def connection_ready(connection):
+    # A pooled connection became free: serve the next waiting request or park it
+    backend = connection.backend
+    connection.request = None
+    while backend.waiting:
+        request = backend.waiting.popleft()
+        if request.client.socket.fileno() != -1:
+            send_request(connection, request)
+            return
+        backend.active -= 1
+    connection.status = 'idle'
+    backend.idle.append(connection)
+
+
+# ---- Backend connections ----
+
+def start_connect(address):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    result = sock.connect_ex(address)
+    if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+        sock.close()
+        raise OSError(result, errno.errorcode.get(result, 'connect failed'))
+    return sock
+
+
+def open_backend_connection(backend):
+    try:
+        sock = start_connect(backend.address)
+    except OSError as e:
+        backend_failed(backend, e)
+        return
+    backend.connections += 1
+    endpoints[sock.fileno()] = BackendConnection(backend, sock)
+
+
+def close_backend_connection(connection):
+    backend = connection.backend
+    endpoints.pop(connection.socket.fileno(), None)
+    connection.socket.close()
+    backend.connections -= 1
+    if connection in backend.idle:
+        backend.idle.remove(connection)
+
+
+def backend_connection_lost(connection, error):
+    backend = connection.backend
+    request = connection.request
+    close_backend_connection(connection)
+    if request is not None:
+        backend.active -= 1
+    backend_failed(backend, error)
+    if request is not None:
+        log.warning("request failed over", backend=backend.name, error=error)
+        dispatch(request)
+
+
+def backend_failed(backend, error):
+    # Take the backend out of rotation and move its queued work elsewhere
+    if backend.healthy:
+        log.warning("backend down", backend=backend.name, error=error)
+    backend.healthy = False
+    backend.next_check = 0.0
+    for connection in list(backend.idle):
+        close_backend_connection(connection)
+    waiting, backend.waiting = backend.waiting, deque()
+    backend.active -= len(waiting)
+    for request in waiting:
+        dispatch(request)
+
+
+def handle_backend_data(connection, data):
+    text = data.decode(errors='replace')
+    if connection.status == 'greeting':
+        connection.status = 'login'
+        connection.out_buffer += backend_credentials
+    elif connection.status == 'login':
+        if text == FAILURE_PACKET:
+            backend_connection_lost(connection, "backend rejected proxy credentials")
+            return
+        connection_ready(connection)
+    elif connection.status == 'busy':
+        # The protocol has no response terminator: one read is one response
+        request = connection.request
+        connection.backend.active -= 1
+        finish_request(request, data)
+        connection_ready(connection)
+
+
+# ---- Health checks ----
+
+def run_health_checks(interval, timeout):
+    now = time.monotonic()
+    for backend in backends:
+        probe = backend.probe
+        if probe is not None and now > probe.deadline:
+            end_probe(probe, False, "health check timed out")
+        elif probe is None and now >= backend.next_check:
+            backend.next_check = now + interval
+            try:
+                sock = start_connect(backend.address)
+            except OSError as e:
+                backend_failed(backend, e)
+                continue
+            backend.probe = HealthProbe(backend, sock, now + timeout)
+            endpoints[sock.fileno()] = backend.probe
+
+
+def end_probe(probe, healthy, error=None):
+    backend = probe.backend
+    endpoints.pop(probe.socket.fileno(), None)
+    probe.socket.close()
+    backend.probe = None
+    if healthy and not backend.healthy:
+        log.info("backend up", backend=backend.name)
+        backend.healthy = True
+    elif not healthy:
+        backend_failed(backend, error)
+
+
+# ---- Clients ----
+
+def accept_clients(listener):
+    while True:
+        try:
+            sock, _ = listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            log.warning("socket accept error", error=e)
+            return
+        sock.setblocking(False)
+        endpoints[sock.fileno()] = ProxyClient(sock)
+
+
+def close_client(client):
+    endpoints.pop(client.socket.fileno(), None)
+    client.socket.close()
+
+
+def handle_client_data(client, data):
+    client.read_buffer += data
+    if not client.read_buffer.endswith(MESSAGE_SEP):
+        # Same framing rule as numbers_server: a read must end on the delimiter
+        close_client(client)
+        return
+    message, client.read_buffer = client.read_buffer, b''
+    text = message[:-1].decode(errors='replace')
+
+    if text.startswith('4'):
+        close_client(client)
+    elif client.status == 'auth':
+        if not text.startswith('0'):
+            close_client(client)
+            return
+        username, _, password = text[2:].partition(',')
+        if users_credentials.get(username) == password and username:
+            client.username = username
+            client.status = 'on'
+            client.out_buffer += f"Hi {username}, good to see you.".encode()
+        else:
+            client.out_buffer += FAILURE_PACKET.encode()
+    elif client.status == 'on':
+        if not is_valid_command(text):
+            close_client(client)
+            return
+        client.status = 'waiting'
+        client.request = Request(client, message, routing_key(text))
+        dispatch(client.request)
+
+
+# ---- Socket events ----
+
+def wants_read(endpoint):
+    if isinstance(endpoint, ProxyClient):
+        return endpoint.status in ('auth', 'on') and not endpoint.out_buffer
+    return endpoint.status != 'connecting'
+
+
+def handle_writable(endpoint):
+    sock = endpoint.socket
+    if endpoint.status == 'connecting':
+        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            endpoint_failed(endpoint, OSError(error, errno.errorcode.get(error, 'connect failed')))
+            return
+        endpoint.status = 'greeting'
+        if not endpoint.out_buffer:
+            return
+    try:
+        sent = sock.send(endpoint.out_buffer)
+        endpoint.out_buffer = endpoint.out_buffer[sent:]
+    except (BlockingIOError, InterruptedError):
+        pass
+    except OSError as e:
+        endpoint_failed(endpoint, e)
+
+
+def handle_readable(endpoint):
+    try:
+        data = endpoint.socket.recv(RECV_SIZE)
+    except (BlockingIOError, InterruptedError):
+        return
+    except OSError as e:
+        endpoint_failed(endpoint, e)
+        return
+    if not data:
+        endpoint_failed(endpoint, "connection closed")
+        return
+
+    if isinstance(endpoint, ProxyClient):
+        handle_client_data(endpoint, data)
+    elif isinstance(endpoint, HealthProbe):
+        end_probe(endpoint, data.decode(errors='replace') == WELCOME_MESSAGE, "unexpected greeting")
+    else:
+        handle_backend_data(endpoint, data)
+
+
+def endpoint_failed(endpoint, error):
+    if isinstance(endpoint, ProxyClient):
+        close_client(endpoint)
+    elif isinstance(endpoint, HealthProbe):
+        end_probe(endpoint, False, error)
+    else:
+        backend_connection_lost(endpoint, error)
+
+
+if __name__ == "__main__":
+    main()
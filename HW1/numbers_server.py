@@ -4,86 +4,211 @@ import sys        # For command-line arguments
 import socket     # For network socket operations
 import select     # For multiplexing I/O over sockets
 from Connection import Connection  # Custom Connection class (assumed to be defined elsewhere)
+from Job import Job  # A command running on the event loop
 import csv        # For CSV file handling (imported but not used)
 import math       # For mathematical operations
+import os         # For removing stale handoff socket paths
+import stat       # For recognizing stale Unix socket files
+import json       # For the handoff channel messages
+import time       # For the drain deadline
+import argparse   # For command-line arguments
+from collections import deque, Counter  # Pending job queue and metrics
+from numbers_log import setup_logging, get_logger  # Queue-backed structured logging
+from spf_table import SpfTable  # Memory-mapped smallest-prime-factor table
+from shared_factor_cache import SharedFactorCache  # Factor cache shared by all workers on the host
+from common.runtime_profiler import install_profiler  # Signal-triggered runtime profiling (numbers_log puts common/ on the path)
+
+log = get_logger('numbers_server')
 
 # Define minimum and maximum 32-bit integer values
 MAX_INT32 = 2**31 - 1
 MIN_INT32 = -MAX_INT32
 
+# Maximum size of a single message on the hot-restart handoff channel
+HANDOFF_MESSAGE_SIZE = 4096
+# TCP and Unix domain listener
+MAX_LISTENING_SOCKETS = 2
+
+# Smallest-prime-factor table, loaded when --spf-table is given
+spf_table = None
+# Cross-process factor cache, opened when --shared-cache is given
+shared_cache = None
+
+# Handlers that can be timed on demand (SIGUSR2)
+PROFILED_HANDLERS = ['handle_read', 'handle_write', 'run_pending_jobs']
+
+# Server-side deadline per command opcode in seconds, overridable with --deadline
+DEFAULT_DEADLINES = {'1': 1.0, '2': 1.0, '3': 10.0, '5': 1.0, '6': 1.0, '7': 1.0, '8': 1.0}
+TIMEOUT_MESSAGE = "error: timeout"
+
+# Admission control: expensive commands are refused with BUSY_MESSAGE when the estimated
+# wait for them exceeds the budget. Login and cheap commands are always admitted.
+EXPENSIVE_OPCODES = ('3',)
+BUSY_MESSAGE = "error: server busy"
+# Starting service time estimates per opcode, refined by an EWMA of observed CPU time
+INITIAL_SERVICE_TIME = {'3': 0.01}
+DEFAULT_SERVICE_TIME = 0.0005
+SERVICE_TIME_SMOOTHING = 0.2
+# Lower bound for the share of wall time pending commands get, the rest goes to socket I/O
+MIN_JOB_SHARE = 0.05
+
+# CPU time the event loop gives pending commands before it goes back to the sockets
+JOB_SLICE_SECONDS = 0.005
+# Opcodes an authenticated client may send ('4' quit is handled before these)
+COMMAND_OPCODES = ('1', '2', '3', '5', '6', '7', '8')
+
+# Miller-Rabin with these bases is deterministic for every n below MILLER_RABIN_BOUND
+MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+MILLER_RABIN_BOUND = 3317044064679887385961981
+
+# Trial divisions between two yields of a running factors command
+FACTOR_STEPS_PER_YIELD = 2048
+# Seconds between two metrics log records
+METRICS_INTERVAL = 60.0
+
+# Commands waiting for CPU time, and counters of how they ended
+pending_jobs = deque()
+# Jobs by normalized request, so identical requests attach to the one already running
+in_flight = {}
+metrics = Counter()
+service_times = dict(INITIAL_SERVICE_TIME)
+job_share = 1.0
+last_run_end = None
+
 def main():
     # Declare global variables for user credentials and socket connections
     global users_credentials
     global readable_sockets, writable_sockets, connections
+    global listening_sockets, handoff_listener, handoff_channel, draining, drain_deadline
+    global spf_table, shared_cache, deadlines, wait_budget
 
-    # Check the number of command-line arguments
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
-        print("Usage: ./numbers_server.py users_file [port]")
-        print("  users_file: Required argument - path to the user file.")
-        print("  port: Optional argument - port number (default is 8080).")
-        sys.exit(1)
+    args = parse_command_line_args()
+    setup_logging(args.log_level)
 
-    # Load user credentials from the provided file
-    users_credentials = fetch_users_credentials_from_file(sys.argv[1])
+    # Map the smallest-prime-factor table; every server process on the host shares its pages
+    if args.spf_table:
+        try:
+            spf_table = SpfTable(args.spf_table)
+        except (OSError, ValueError) as e:
+            log.error("could not load smallest-prime-factor table", path=args.spf_table, error=e)
+            sys.exit(1)
+        log.info("loaded smallest-prime-factor table", path=args.spf_table, bound=spf_table.bound)
 
-    # Parse the optional port argument or use default port 1338
-    if len(sys.argv) == 3:
+    if args.shared_cache:
         try:
-            port = int(sys.argv[2])
-        except ValueError:
-            print("Error: Port must be an integer.")
+            shared_cache = SharedFactorCache(args.shared_cache, args.shared_cache_slots)
+        except (OSError, ValueError) as e:
+            log.error("could not open shared factor cache", name=args.shared_cache, error=e)
             sys.exit(1)
-    else:
-        port = 1337  # Default port if not specified
+        log.info("opened shared factor cache", name=args.shared_cache, slots=shared_cache.slots)
 
-    # Create and set up the server socket
-    try:
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.bind(('', port))
-        server_socket.listen(10)
-    except socket.error as e:
-        print(f"Error: Could not start server on port {port}. {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Unexpected error: {e}")
+    deadlines = dict(DEFAULT_DEADLINES)
+    deadlines.update(args.deadline)
+    wait_budget = args.wait_budget
+
+    # SIGUSR1 toggles the profiler, SIGUSR2 toggles handler timing
+    install_profiler(globals(), PROFILED_HANDLERS, args.profile_dir, 'numbers_server', args.profile_mode)
+
+    # Load user credentials from the provided file
+    users_credentials = fetch_users_credentials_from_file(args.users_file)
+
+    if args.no_tcp and not args.unix:
+        log.error("--no-tcp needs --unix, the server would have nothing to listen on")
         sys.exit(1)
 
+    # Take over the listening sockets of a running server if one is waiting at the handoff path,
+    # otherwise create and set up fresh TCP and/or Unix domain server sockets
+    listening_sockets, handoff_channel = None, None
+    if args.handoff:
+        listening_sockets, handoff_channel = take_over_from_running_server(args.handoff)
+    if listening_sockets is None:
+        listening_sockets = []
+        try:
+            if not args.no_tcp:
+                server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                server_socket.bind(('', args.port))
+                server_socket.listen(10)
+                listening_sockets.append(server_socket)
+            if args.unix:
+                # Co-located clients skip the TCP loopback stack; same protocol, same event loop
+                if os.path.exists(args.unix) and stat.S_ISSOCK(os.stat(args.unix).st_mode):
+                    os.unlink(args.unix)
+                unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                unix_socket.bind(args.unix)
+                unix_socket.listen(10)
+                listening_sockets.append(unix_socket)
+        except socket.error as e:
+            log.error("could not start server", port=args.port, unix=args.unix, error=e)
+            sys.exit(1)
+        except Exception as e:
+            log.error("unexpected error during startup", error=e)
+            sys.exit(1)
+
     # Initialize lists for readable and writable sockets and a dictionary for connections
-    readable_sockets = [server_socket]
+    readable_sockets = list(listening_sockets)
     writable_sockets = []
     connections = {}
+    draining = False
+    drain_deadline = None
+    drain_timeout = args.drain_timeout
+
+    if handoff_channel is not None:
+        # Sessions of the old process keep arriving on the channel until it is done draining
+        readable_sockets.append(handoff_channel)
+
+    handoff_listener = None
+    if args.handoff:
+        handoff_listener = start_handoff_listener(args.handoff)
+        readable_sockets.append(handoff_listener)
+
+    next_metrics_log = time.monotonic() + METRICS_INTERVAL
 
     # Server loop to handle incoming connections and data
     while True:
         try:
-            # Use select to get readable and writable sockets without blocking
-            readables, writables, _ = select.select(readable_sockets, writable_sockets, [], 0)
+            # Use select to get readable and writable sockets, without blocking while commands are pending
+            timeout = 0 if pending_jobs else 0.05
+            readables, writables, _ = select.select(readable_sockets, writable_sockets, [], timeout)
         except select.error as e:
-            print(f"Select error: {e}")
+            log.error("select error", error=e)
             continue
         except Exception as e:
-            print(f"Unexpected error during select: {e}")
+            log.error("unexpected error during select", error=e)
             continue
 
         # Handle readable sockets
         for readable_socket in readables:
-            if readable_socket is server_socket:
+            if readable_socket.fileno() == -1:
+                # Closed earlier in this pass (handed off or disconnected)
+                continue
+            if readable_socket is handoff_listener:
+                # A new server process wants our listening socket
+                hand_off_listener(drain_timeout)
+            elif readable_socket is handoff_channel:
+                # An idle session handed over by the process we replaced
+                receive_handed_off_session()
+            elif readable_socket in listening_sockets:
                 # Accept new client connections
                 try:
-                    client_socket, client_address = server_socket.accept()
+                    client_socket, client_address = readable_socket.accept()
                     readable_sockets.append(client_socket)
                     writable_sockets.append(client_socket)
                     connections[client_socket.fileno()] = Connection(client_socket)
                 except socket.error as e:
-                    print(f"Socket accept error: {e}")
+                    log.warning("socket accept error", error=e)
                     continue
                 except Exception as e:
-                    print(f"Unexpected error during accept: {e}")
+                    log.error("unexpected error during accept", error=e)
                     continue
             else:
                 # Read data from existing client connections
                 try:
                     connection = connections[readable_socket.fileno()]
+                    if connection.status == 'busy':
+                        # Only watch for a hang-up while a command runs, so its work can be cancelled
+                        if not readable_socket.recv(1, socket.MSG_PEEK):
+                            disconnect_client(connection)
+                        continue
                     if not is_read_mode(connection):
                         continue
                     data = readable_socket.recv(1024).decode()
@@ -95,7 +220,7 @@ def main():
                     disconnect_client(connection)
                     continue
                 except Exception as e:
-                    print(f"Error handling read from socket: {e}")
+                    log.warning("error handling read from socket", error=e)
                     disconnect_client(connection)
                     continue
 
@@ -109,10 +234,177 @@ def main():
                     continue
                 handle_write(connection)
             except Exception as e:
-                print(f"Error handling write to socket: {e}")
+                log.warning("error handling write to socket", error=e)
                 disconnect_client(connection)
                 continue
 
+        # Give running commands their slice of CPU time
+        if pending_jobs:
+            run_pending_jobs()
+
+        if time.monotonic() >= next_metrics_log:
+            log_metrics()
+            next_metrics_log = time.monotonic() + METRICS_INTERVAL
+
+        if draining:
+            finish_draining()
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description="Numbers server")
+    parser.add_argument("users_file", help="Required argument - path to the user file.")
+    parser.add_argument("port", type=int, nargs='?', default=1337,
+                        help="Optional argument - port number (default is 1337).")
+    parser.add_argument("--unix", metavar="PATH",
+                        help="Also listen on a Unix domain socket at PATH for clients on this host.")
+    parser.add_argument("--no-tcp", action="store_true",
+                        help="Don't listen on TCP, only on the --unix socket.")
+    parser.add_argument("--handoff", metavar="PATH",
+                        help="Unix socket path used for zero-downtime restarts. A server started with the same "
+                             "path takes over the listening socket and idle sessions of the running one.")
+    parser.add_argument("--drain-timeout", type=float, default=30.0,
+                        help="Seconds a replaced server waits for busy sessions before closing them (default: 30).")
+    parser.add_argument("--spf-table", metavar="PATH",
+                        help="Smallest-prime-factor table built by spf_table.py. Numbers below its bound are "
+                             "factored by table lookup instead of trial division.")
+    parser.add_argument("--shared-cache", metavar="NAME",
+                        help="Name of a shared memory factor cache. Every server started with the same name on "
+                             "this host reads and fills the same cache.")
+    parser.add_argument("--shared-cache-slots", type=int, default=1 << 16,
+                        help="Slots of the shared cache when this server creates it (default: 65536).")
+    parser.add_argument("--deadline", action="append", default=[], type=parse_deadline, metavar="OPCODE=SECONDS",
+                        help="Server-side deadline for a command opcode, e.g. 3=5. Repeat for more opcodes "
+                             "(defaults: " + ", ".join(f"{op}={sec:g}" for op, sec in DEFAULT_DEADLINES.items()) + ").")
+    parser.add_argument("--wait-budget", type=float, default=2.0,
+                        help="Refuse expensive commands with a busy reply once their estimated wait exceeds "
+                             "this many seconds (default: 2). 0 disables admission control.")
+    parser.add_argument("--profile-dir", default=".",
+                        help="Directory for profiles written on SIGUSR1/SIGUSR2 (default: current directory).")
+    parser.add_argument("--profile-mode", default="cprofile", choices=["cprofile", "sample"],
+                        help="cprofile for deterministic profiles, sample for flamegraph-ready stack samples.")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Minimum level of log records to write (default: INFO).")
+    return parser.parse_args()
+
+def parse_deadline(value):
+    opcode, _, seconds = value.partition('=')
+    try:
+        return opcode, float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected OPCODE=SECONDS, got {value!r}")
+
+def take_over_from_running_server(path):
+    # Ask the server listening on the handoff path for its listening sockets.
+    # Returns (None, None) when no server is running there.
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    try:
+        channel.connect(path)
+        message, fds, _, _ = socket.recv_fds(channel, HANDOFF_MESSAGE_SIZE, MAX_LISTENING_SOCKETS)
+    except (FileNotFoundError, ConnectionRefusedError):
+        channel.close()
+        return None, None
+    except OSError as e:
+        log.error("handoff from running server failed", path=path, error=e)
+        channel.close()
+        return None, None
+
+    if not fds or json.loads(message.decode()).get('type') != 'listener':
+        log.error("running server did not send its listening sockets", path=path)
+        channel.close()
+        return None, None
+    log.info("took over listening sockets from running server", path=path, sockets=len(fds))
+    return [socket.socket(fileno=fd) for fd in fds], channel
+
+def start_handoff_listener(path):
+    # Listen for the next server process that wants to take over from us
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    listener.bind(path)
+    listener.listen(1)
+    return listener
+
+def hand_off_listener(drain_timeout):
+    # Pass the listening sockets to the new process and start draining our own sessions
+    global handoff_listener, handoff_out, draining, drain_deadline
+    try:
+        channel, _ = handoff_listener.accept()
+        fds = [listening_socket.fileno() for listening_socket in listening_sockets]
+        socket.send_fds(channel, [json.dumps({'type': 'listener'}).encode()], fds)
+    except OSError as e:
+        log.error("error handing off listening socket", error=e)
+        return
+
+    # The new process owns the path now, so close our end without unlinking it
+    readable_sockets.remove(handoff_listener)
+    handoff_listener.close()
+    handoff_listener = None
+
+    # Stop accepting: closing our copies leaves the sockets listening in the new process
+    for listening_socket in listening_sockets:
+        readable_sockets.remove(listening_socket)
+        listening_socket.close()
+    listening_sockets.clear()
+
+    handoff_out = channel
+    draining = True
+    drain_deadline = time.monotonic() + drain_timeout
+    log.info("handed off listening socket, draining connections", connections=len(connections))
+
+def finish_draining():
+    # Hand idle sessions to the new process; exit once nothing is left
+    for connection in list(connections.values()):
+        if is_idle(connection):
+            hand_off_session(connection)
+
+    if connections and time.monotonic() < drain_deadline:
+        return
+    for connection in list(connections.values()):
+        disconnect_client(connection)
+    handoff_out.close()
+    log.info("drained all connections, exiting")
+    sys.exit(0)
+
+def is_idle(connection):
+    # A session is idle while it waits for the client's next request with nothing buffered
+    return connection.status in ('auth', 'on') and connection.read_buffer == ''
+
+def hand_off_session(connection):
+    state = {'type': 'session', 'status': connection.status, 'username': connection.username}
+    try:
+        socket.send_fds(handoff_out, [json.dumps(state).encode()], [connection.socket.fileno()])
+    except OSError as e:
+        log.warning("error handing off session", username=connection.username, error=e)
+        disconnect_client(connection)
+        return
+    # The new process holds its own copy of the socket, so closing ours doesn't end the session
+    disconnect_client(connection)
+
+def receive_handed_off_session():
+    global handoff_channel
+    try:
+        message, fds, _, _ = socket.recv_fds(handoff_channel, HANDOFF_MESSAGE_SIZE, 1)
+    except OSError:
+        message, fds = b'', []
+    if not message:
+        # The old process finished draining
+        readable_sockets.remove(handoff_channel)
+        handoff_channel.close()
+        handoff_channel = None
+        return
+
+    state = json.loads(message.decode())
+    if state.get('type') != 'session' or not fds:
+        return
+    client_socket = socket.socket(fileno=fds[0])
+    connection = Connection(client_socket)
+    connection.status = state['status']
+    connection.username = state['username']
+    readable_sockets.append(client_socket)
+    writable_sockets.append(client_socket)
+    connections[client_socket.fileno()] = connection
+
 def is_read_mode(connection):
     # Determine if the connection is ready to read data
     return connection.status == 'auth' or connection.status == 'on'
@@ -145,10 +437,10 @@ def fetch_users_credentials_from_file(file):
         return users
 
     except FileNotFoundError:
-        print("Error: File not found.")
+        log.error("users file not found", path=file)
         sys.exit(1)
     except ValueError:
-        print("Error: Invalid file format.")
+        log.error("invalid users file format", path=file)
         sys.exit(1)
 
 def disconnect_client(connection):
@@ -161,6 +453,10 @@ def disconnect_client(connection):
         writable_sockets.remove(socket)
     if socket.fileno() in connections:
         del connections[socket.fileno()]
+    if connection.job is not None:
+        # This client won't read the answer; the job stops once no other client waits for it
+        connection.job.remove_waiter(connection)
+        connection.job = None
     socket.close()
 
 def authenticate(connection, data):
@@ -198,7 +494,7 @@ def handle_write(connection):
         try:
             send_all(connection.socket, message)
         except Exception as e:
-            print(f"Error sending data to client: {e}")
+            log.warning("error sending data to client", error=e)
             disconnect_client(connection)
             return
         connection.read_buffer = ""
@@ -234,22 +530,137 @@ def handle_read(connection, data):
             connection.read_buffer = ''
 
         elif connection.status == 'on':
-            if not (connection.read_buffer.startswith('1') or
-                    connection.read_buffer.startswith('2') or
-                    connection.read_buffer.startswith('3')):
-                # Expecting a command starting with '1', '2', or '3'
+            if connection.read_buffer[:1] not in COMMAND_OPCODES:
+                # Expecting a command starting with one of the command opcodes
                 disconnect_client(connection)
                 return
 
-            result = execute_command(connection, connection.read_buffer)
-            if not result:
-                disconnect_client(connection)
-                return
-            connection.read_buffer = result
-            connection.status = 'result'
+            opcode = connection.read_buffer[0]
+            deadline = time.monotonic() + deadlines.get(opcode, 1.0)
+            key = request_key(connection.read_buffer)
+            job = in_flight.get(key) if key is not None else None
+            if job is not None:
+                # Single flight: the same request is already being computed, wait for its answer
+                metrics['coalesced'] += 1
+                metrics[f'coalesced_{opcode}'] += 1
+            else:
+                # Shed load early: a fast "busy" beats an answer that arrives after everyone gave up
+                if wait_budget and opcode in EXPENSIVE_OPCODES and estimated_wait(opcode) > wait_budget:
+                    metrics['rejected_busy'] += 1
+                    connection.read_buffer = BUSY_MESSAGE
+                    connection.status = 'result'
+                    return
+                # The command runs from the event loop under its opcode's deadline
+                job = Job(key, opcode, execute_command(connection.read_buffer))
+                if key is not None:
+                    in_flight[key] = job
+                pending_jobs.append(job)
+            job.add_waiter(connection, deadline)
+            connection.job = job
+            connection.status = 'busy'
+
+def run_pending_jobs():
+    # Round-robin the pending commands, one step each, until the slice is used up
+    global job_share, last_run_end
+    slice_end = time.perf_counter() + JOB_SLICE_SECONDS
+    stepped = 0.0
+    while pending_jobs and time.perf_counter() < slice_end:
+        job = pending_jobs.popleft()
+        now = time.monotonic()
+        if not job.cancelled and now > job.deadline:
+            # Each waiter times out on its own deadline; the job runs on for the others
+            for connection in job.expired_waiters(now):
+                metrics['timed_out'] += 1
+                metrics[f'timed_out_{job.opcode}'] += 1
+                finish_waiter(connection, TIMEOUT_MESSAGE)
+        if job.cancelled:
+            metrics['cancelled'] += 1
+            job.steps.close()
+            drop_in_flight(job)
+            continue
+        step_start = time.perf_counter()
+        try:
+            next(job.steps)
+        except StopIteration as done:
+            step_time = time.perf_counter() - step_start
+            job.cpu_time += step_time
+            stepped += step_time
+            metrics['completed'] += 1
+            record_service_time(job)
+            finish_job(job, done.value)
+            continue
+        step_time = time.perf_counter() - step_start
+        job.cpu_time += step_time
+        stepped += step_time
+        pending_jobs.append(job)
+
+    # Track the share of wall time the commands get between two back-to-back slices
+    now = time.perf_counter()
+    if last_run_end is not None:
+        share = stepped / (now - last_run_end)
+        job_share += SERVICE_TIME_SMOOTHING * (share - job_share)
+    last_run_end = now if pending_jobs else None
+
+def record_service_time(job):
+    previous = service_times.get(job.opcode, DEFAULT_SERVICE_TIME)
+    service_times[job.opcode] = previous + SERVICE_TIME_SMOOTHING * (job.cpu_time - previous)
+
+def estimated_wait(opcode):
+    # Pending jobs share the CPU round-robin, so a new job runs alongside every one of
+    # them. Under overload the queue stays about as long (finished jobs are replaced by
+    # new ones), so each pending job costs the new one up to its own service time again.
+    # Scaled by the share of wall time the event loop leaves over for commands.
+    own = service_times.get(opcode, DEFAULT_SERVICE_TIME)
+    shared = sum(min(service_times.get(job.opcode, DEFAULT_SERVICE_TIME), own) for job in pending_jobs)
+    return (own + shared) / max(job_share, MIN_JOB_SHARE)
+
+def finish_job(job, result):
+    # Every client waiting on the job gets the same response
+    drop_in_flight(job)
+    for connection in list(job.waiters):
+        finish_waiter(connection, result)
+    job.waiters.clear()
+
+def finish_waiter(connection, result):
+    # Hand the command's response to the write path, or drop the client on a protocol error
+    connection.job = None
+    if not result:
+        disconnect_client(connection)
+        return
+    connection.read_buffer = result
+    connection.status = 'result'
 
-def execute_command(connection, data):
-    # Execute the client's command based on the protocol
+def drop_in_flight(job):
+    if in_flight.get(job.key) is job:
+        del in_flight[job.key]
+
+def request_key(data):
+    # Normalized form of a pure command, equal for requests that must get the same response.
+    # None when the request doesn't parse: it runs on its own and fails there.
+    try:
+        opcode, payload = data[0], data[2:]
+        if opcode == '1':
+            num1, op, num2 = payload.split()
+            return (opcode, int(num1), op, int(num2))
+        if opcode in ('3', '5'):
+            return (opcode, int(payload))
+        if opcode == '6':
+            return (opcode, *(int(number) for number in payload.split()))
+        if opcode in ('2', '7', '8'):
+            # Order and repetitions don't change a max, gcd or lcm
+            return (opcode, tuple(sorted(set(parse_number_list(payload)))))
+    except ValueError:
+        return None
+    return None
+
+def log_metrics():
+    if metrics:
+        log.info("command metrics", pending=len(pending_jobs), in_flight=len(in_flight), **metrics)
+
+def execute_command(data):
+    # Execute the client's command based on the protocol.
+    # This is a generator: it yields while work is left so the event loop can interleave
+    # other clients and enforce deadlines, and returns the response (None drops the client).
     try:
         if data.startswith('1'):
             # Calculate operation
@@ -258,15 +669,71 @@ def execute_command(connection, data):
             return str(calculate(num1=int(num1), op=op, num2=int(num2)))
         if data.startswith('2'):
             # Find maximum number
-            return maximum(connection, data[2:])
+            return maximum(data[2:])
         if data.startswith('3'):
             # Find prime factors
-            return factors(connection, data[2:])
+            return (yield from factors(data[2:]))
+        if data.startswith('5'):
+            # Primality test
+            return is_prime_command(int(data[2:]))
+        if data.startswith('6'):
+            # Modular exponentiation
+            base, exponent, modulus = data[2:].split()
+            return modpow(int(base), int(exponent), int(modulus))
+        if data.startswith('7'):
+            # Greatest common divisor of a list
+            return "the gcd is " + str(math.gcd(*parse_number_list(data[2:])))
+        if data.startswith('8'):
+            # Least common multiple of a list
+            return "the lcm is " + str(math.lcm(*parse_number_list(data[2:])))
         return None
     except Exception as e:
-        print(f"Error executing command: {e}")
+        log.warning("error executing command", sample=100, error=e)
         return None
 
+def parse_number_list(data):
+    # Comma separated integers, same format as the max command
+    return [int(number) for number in data.split(',')]
+
+def is_prime_command(n):
+    if not is_prime(n):
+        return f"{n} is not prime"
+    # Above the bound a composite can pass every base, so only "not prime" is certain there
+    return f"{n} is prime" if n < MILLER_RABIN_BOUND else f"{n} is probably prime"
+
+def is_prime(n):
+    # Miller-Rabin: deterministic below MILLER_RABIN_BOUND, a strong probable-prime test above it
+    if n < 2:
+        return False
+    for p in MILLER_RABIN_BASES:
+        if n % p == 0:
+            return n == p
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    for a in MILLER_RABIN_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(r - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def modpow(base, exponent, modulus):
+    # Three-argument pow reduces after every multiplication, so intermediates never exceed modulus**2
+    if modulus <= 0:
+        return "error: modulus must be positive"
+    try:
+        return "response: " + str(pow(base, exponent, modulus)) + "."
+    except ValueError:
+        # Negative exponent with a base that has no inverse modulo modulus
+        return "error: base is not invertible"
+
 def calculate(num1, op, num2):
     # Perform basic arithmetic operations
     try:
@@ -282,6 +749,9 @@ def calculate(num1, op, num2):
                 return "error: division by zero"
             res = round(num1 / num2, 2)
         elif op == '^':
+            # Refuse before computing: a 9-digit exponent would take seconds and gigabytes
+            if abs(num1) > 1 and num2 > 0 and num2 * math.log2(abs(num1)) > 64:
+                return "error: result is too big"
             res = num1 ** num2
         else:
             return "error: unknown operation"
@@ -299,42 +769,64 @@ def calculate(num1, op, num2):
     except Exception as e:
         return f"error: {e}"
 
-def maximum(connection, data):
-    # Find the maximum number in a list provided by the client
+def maximum(data):
+    # Find the maximum number in a list provided by the client (None drops the client)
     try:
         numbers = data.split(',')
         numbers = [int(number) for number in numbers]
         return "the maximum is " + str(max(numbers))
     except Exception as e:
-        print(f"Error in maximum function: {e}")
-        disconnect_client(connection)
+        log.warning("error in maximum function", sample=100, error=e)
         return None
 
-def factors(connection, data):
-    # Calculate the prime factors of a given number
+def factors(data):
+    # Calculate the prime factors of a given number (None drops the client).
+    # The response echoes the parsed number, so every request coalesced onto it reads the same.
     try:
         n = int(data)
-        factors = set()
-        divisor = 2
-
-        while n > 1:
-            while n % divisor == 0:
-                factors.add(divisor)
-                n //= divisor
-            divisor += 1
-
-            if divisor * divisor > n:
-                if n > 1:
-                    factors.add(n)
-                    break
-        factors = sorted(factors)
-        return f"the prime factors of {data} are: {str(factors)[1:-1]}"
+        factors = yield from prime_factors(n)
+        return f"the prime factors of {n} are: {str(factors)[1:-1]}"
     except ValueError:
         return None
     except Exception as e:
-        print(f"Error in factors function: {e}")
-        disconnect_client(connection)
+        log.warning("error in factors function", sample=100, error=e)
         return None
 
+def prime_factors(n):
+    # Distinct prime factors in ascending order: table lookups below the table bound, trial division above it.
+    # Generator: yields every FACTOR_STEPS_PER_YIELD divisors so long factorizations can be interleaved and cancelled.
+    if spf_table is not None and spf_table.covers(n):
+        return spf_table.prime_factors(n)
+    if shared_cache is not None:
+        cached = shared_cache.get(n)
+        if cached is not None:
+            metrics['shared_cache_hits'] += 1
+            return cached
+        metrics['shared_cache_misses'] += 1
+
+    original = n
+    factors = set()
+    divisor = 2
+    steps = 0
+
+    while n > 1:
+        while n % divisor == 0:
+            factors.add(divisor)
+            n //= divisor
+        divisor += 1
+        steps += 1
+        if steps == FACTOR_STEPS_PER_YIELD:
+            steps = 0
+            yield
+
+        if divisor * divisor > n:
+            if n > 1:
+                factors.add(n)
+                break
+    factors = sorted(factors)
+    if shared_cache is not None:
+        shared_cache.put(original, factors)
+    return factors
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""
+Round-trip latency of numbers_server over TCP loopback vs. a Unix domain socket.
+
+Starts a server listening on both transports, logs in over each one and
+times a series of cheap '1' (calculate) requests, so the numbers mostly show
+the transport cost rather than the command.
+
+    ./numbers_transport_benchmark.py users.txt --requests 20000
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+
+MESSAGE_SEP = "\\"
+
+
+def connect(family, address, user, password):
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    for _ in range(50):
+        try:
+            sock.connect(address)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            time.sleep(0.1)
+    else:
+        raise RuntimeError(f"server did not come up on {address}")
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.recv(1024)
+    sock.sendall(f"0 {user},{password}{MESSAGE_SEP}".encode())
+    if sock.recv(1024) == b"N":
+        raise RuntimeError(f"login as {user} failed")
+    return sock
+
+
+def measure(sockets, requests, warmup):
+    # Alternate between the transports so CPU frequency and cache effects hit both equally
+    request = f"1 1 + 1{MESSAGE_SEP}".encode()
+    samples = [[] for _ in sockets]
+    for i in range(warmup + requests):
+        for sock, sock_samples in zip(sockets, samples):
+            start = time.perf_counter()
+            sock.sendall(request)
+            sock.recv(1024)
+            if i >= warmup:
+                sock_samples.append(time.perf_counter() - start)
+    for sock_samples in samples:
+        sock_samples.sort()
+    return samples
+
+
+def summarize(name, samples):
+    def pct(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1e6
+    mean = sum(samples) / len(samples) * 1e6
+    print(f"{name:<6} n={len(samples):<7} mean={mean:8.1f}us p50={pct(50):8.1f}us "
+          f"p90={pct(90):8.1f}us p99={pct(99):8.1f}us")
+    return pct(50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare numbers_server round trips over TCP and Unix sockets")
+    parser.add_argument("users_file", help="Users file passed to the server; the first user is used to log in.")
+    parser.add_argument("-p", "--port", type=int, default=13370, help="TCP port for the benchmark server.")
+    parser.add_argument("-n", "--requests", type=int, default=10000, help="Timed requests per transport.")
+    parser.add_argument("--warmup", type=int, default=500, help="Untimed requests before measuring.")
+    args = parser.parse_args()
+
+    with open(args.users_file) as f:
+        user, password = f.readline().split()
+
+    unix_path = os.path.join(tempfile.mkdtemp(), "numbers.sock")
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "numbers_server.py")
+    server = subprocess.Popen([sys.executable, server_path, args.users_file, str(args.port),
+                               "--unix", unix_path, "--log-level", "ERROR"])
+    try:
+        tcp = connect(socket.AF_INET, ("127.0.0.1", args.port), user, password)
+        unix = connect(socket.AF_UNIX, unix_path, user, password)
+        tcp_samples, unix_samples = measure([tcp, unix], args.requests, args.warmup)
+        tcp_median = summarize("tcp", tcp_samples)
+        unix_median = summarize("unix", unix_samples)
+        print(f"median unix socket round trip takes {unix_median / tcp_median:.0%} of the tcp one")
+        tcp.close()
+        unix.close()
+    finally:
+        server.terminate()
+        server.wait()
+        if os.path.exists(unix_path):
+            os.unlink(unix_path)
+        os.rmdir(os.path.dirname(unix_path))
+
+
+if __name__ == "__main__":
+    main()
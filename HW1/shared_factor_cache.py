@@ -0,0 +1,184 @@
+"""
+Cross-process cache of prime factorizations in shared memory.
+
+Every numbers_server process on a host that opens the cache under the same
+name maps the same fixed-size table, so a number factored by one worker is
+a cache hit for all of them.
+
+Layout: a small header followed by `slots` fixed-size slots used as an open
+addressing hash table with linear probing (at most MAX_PROBES slots per key).
+Each slot holds a sequence counter, the key and up to MAX_FACTORS distinct
+prime factors as uint64, which covers every n < 2**64.
+
+Reads are lock-free seqlock reads: read the sequence, the slot and the
+sequence again, and retry if a writer was active (odd sequence) or the
+sequence moved. Writers serialize per slot through striped fcntl byte-range
+locks on a lock file, which work between unrelated processes.
+"""
+
+import os
+import sys
+import time
+import fcntl
+import struct
+import tempfile
+from multiprocessing import shared_memory, resource_tracker
+
+MAGIC = b'SFC1'
+HEADER = struct.Struct('<4sII')           # magic, slot count, slot size
+HEADER_SIZE = 64
+MAX_FACTORS = 15                          # The product of the first 16 primes exceeds 2**64
+SEQUENCE = struct.Struct('<I')
+ENTRY = struct.Struct(f'<QB3x{MAX_FACTORS}Q')  # key + 1 (0 marks an empty slot), factor count, factors
+SLOT_SIZE = SEQUENCE.size + ENTRY.size
+MAX_PROBES = 8
+LOCK_STRIPES = 256
+READ_RETRIES = 4
+MAX_KEY = 2**64 - 2
+
+# The cache must outlive any single worker, but by default the resource tracker of the
+# process that opened a segment unlinks it when that process exits. Python 3.13 can open
+# it untracked; older versions track it and the registration is removed right after.
+UNTRACKED = sys.version_info >= (3, 13)
+
+
+def slot_hash(n):
+    # splitmix64 finalizer: spreads sequential numbers over the whole table
+    n = (n + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    n = ((n ^ (n >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    n = ((n ^ (n >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return n ^ (n >> 31)
+
+
+class SharedFactorCache:
+    def __init__(self, name, slots=1 << 16):
+        """
+
+        Opens the cache called name, creating it with the given number of slots if no process has yet.
+
+        Parameters:
+
+        name (str): shared memory name, the same for every worker on the host
+
+        slots (int): table size used when the cache is created
+
+        """
+        size = HEADER_SIZE + slots * SLOT_SIZE
+        try:
+            self.memory = open_shared_memory(name, create=True, size=size)
+            HEADER.pack_into(self.memory.buf, 0, MAGIC, slots, SLOT_SIZE)
+        except FileExistsError:
+            self.memory = open_shared_memory(name)
+            self.wait_for_header(name)
+
+        _, self.slots, slot_size = HEADER.unpack_from(self.memory.buf, 0)
+        if slot_size != SLOT_SIZE:
+            raise ValueError(f"shared cache {name} has an incompatible layout")
+        self.buffer = self.memory.buf
+        self.lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), 'a+b')
+
+    def wait_for_header(self, name):
+        # The creating process may not have written the header yet
+        for _ in range(100):
+            if bytes(self.memory.buf[:len(MAGIC)]) == MAGIC:
+                return
+            time.sleep(0.01)
+        raise ValueError(f"shared memory {name} is not a factor cache")
+
+    def offset(self, index):
+        return HEADER_SIZE + index * SLOT_SIZE
+
+    def read_slot(self, index):
+        # Seqlock read: returns (key + 1, factors) or None if writers kept the slot busy
+        buffer = self.buffer
+        offset = self.offset(index)
+        for _ in range(READ_RETRIES):
+            before = SEQUENCE.unpack_from(buffer, offset)[0]
+            if before & 1:
+                continue
+            key, count, *factors = ENTRY.unpack_from(buffer, offset + SEQUENCE.size)
+            if SEQUENCE.unpack_from(buffer, offset)[0] == before:
+                return key, factors[:count]
+        return None
+
+    def get(self, n):
+        """
+
+        Returns the cached factor list of n, or None on a miss.
+
+        """
+        if not 0 <= n <= MAX_KEY:
+            return None
+        home = slot_hash(n) % self.slots
+        for probe in range(MAX_PROBES):
+            entry = self.read_slot((home + probe) % self.slots)
+            if entry is None or entry[0] == 0:
+                break
+            if entry[0] == n + 1:
+                return entry[1]
+        return None
+
+    def put(self, n, factors):
+        """
+
+        Stores the factor list of n. Entries that don't fit the slot layout are skipped, and so is
+        one that keeps losing its slot to concurrent writers.
+
+        """
+        if not 0 <= n <= MAX_KEY or len(factors) > MAX_FACTORS:
+            return
+        home = slot_hash(n) % self.slots
+        padded = list(factors) + [0] * (MAX_FACTORS - len(factors))
+        # Each failed attempt means another writer filled a probed slot, so this ends within MAX_PROBES
+        for _ in range(MAX_PROBES):
+            index = self.find_slot(home, n)
+            # With every probed slot taken by other keys, the home slot is overwritten
+            target = home if index is None else index
+            stripe = target % LOCK_STRIPES
+            fcntl.lockf(self.lock_file, fcntl.LOCK_EX, 1, stripe)
+            try:
+                offset = self.offset(target)
+                # find_slot looked without the lock: another writer may have taken the slot since
+                if index is not None and ENTRY.unpack_from(self.buffer, offset + SEQUENCE.size)[0] not in (0, n + 1):
+                    continue
+                sequence = SEQUENCE.unpack_from(self.buffer, offset)[0]
+                SEQUENCE.pack_into(self.buffer, offset, (sequence + 1) & 0xFFFFFFFF)
+                ENTRY.pack_into(self.buffer, offset + SEQUENCE.size, n + 1, len(factors), *padded)
+                SEQUENCE.pack_into(self.buffer, offset, (sequence + 2) & 0xFFFFFFFF)
+                return
+            finally:
+                fcntl.lockf(self.lock_file, fcntl.LOCK_UN, 1, stripe)
+
+    def find_slot(self, home, n):
+        # The slot already holding n, else the first empty one, else None when other keys fill every probed slot
+        for probe in range(MAX_PROBES):
+            index = (home + probe) % self.slots
+            entry = self.read_slot(index)
+            if entry is not None and entry[0] in (0, n + 1):
+                return index
+        return None
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        self.lock_file.close()
+
+    def unlink(self):
+        # Removes the shared memory segment for every process; only for tearing a deployment down.
+        # A tracked segment's unlink() unregisters it from the resource tracker, so register it back first.
+        if not UNTRACKED:
+            resource_tracker.register(tracker_name(self.memory), 'shared_memory')
+        self.memory.unlink()
+
+
+def open_shared_memory(name, create=False, size=0):
+    if UNTRACKED:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    memory = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(tracker_name(memory), 'shared_memory')
+    return memory
+
+
+def tracker_name(memory):
+    # The tracker knows a POSIX segment by its shm_open path, the public name with a leading slash
+    return '/' + memory.name
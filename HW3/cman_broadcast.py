@@ -0,0 +1,156 @@
+"""
+Sends one datagram to many addresses with as few system calls as possible.
+
+On Linux a RecipientBatch hands the whole recipient list to sendmmsg(2)
+through ctypes, up to MAX_BATCH datagrams per call. The sockaddr and
+mmsghdr arrays are built once when the recipients change, so a broadcast
+only points the shared iovec at the new packet. Elsewhere (or when libc
+has no sendmmsg) it falls back to a plain sendto loop.
+
+Usage:
+    watchers = RecipientBatch(server_socket, addrs)
+    failed = watchers.send(packet)
+"""
+
+import sys
+import errno
+import ctypes
+import ctypes.util
+import socket
+
+# Datagrams handed to one sendmmsg call (the kernel's UIO_MAXIOV limit)
+MAX_BATCH = 1024
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IoVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    # Port and address are stored in network byte order
+    _fields_ = [('sin_family', ctypes.c_ushort), ('sin_port', ctypes.c_uint16),
+                ('sin_addr', ctypes.c_uint8 * 4), ('sin_zero', ctypes.c_uint8 * 8)]
+
+
+def _load_sendmmsg():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+def has_sendmmsg():
+    return _sendmmsg is not None
+
+
+class RecipientBatch:
+    def __init__(self, sock, addrs, use_sendmmsg=True):
+        """
+
+        Parameters:
+
+        sock (socket.socket): a non-blocking AF_INET datagram socket
+
+        addrs (list(tuple(str, int))): the recipients, as returned by recvfrom
+
+        use_sendmmsg (bool): False forces the sendto loop, e.g. for comparisons
+
+        """
+        self.sock = sock
+        self.addrs = list(addrs)
+        self.messages = None
+        if use_sendmmsg and _sendmmsg is not None and sock.family == socket.AF_INET and self.addrs:
+            self.build_messages()
+
+    def build_messages(self):
+        count = len(self.addrs)
+        self.iov = _IoVec()
+        self.names = (_SockAddrIn * count)()
+        self.messages = (_MMsgHdr * count)()
+        name_size = ctypes.sizeof(_SockAddrIn)
+        names_base = ctypes.addressof(self.names)
+        iov_pointer = ctypes.pointer(self.iov)
+        for i, (host, port) in enumerate(self.addrs):
+            name = self.names[i]
+            name.sin_family = socket.AF_INET
+            name.sin_port = socket.htons(port)
+            name.sin_addr[:] = socket.inet_aton(host)
+            header = self.messages[i].msg_hdr
+            header.msg_name = names_base + i * name_size
+            header.msg_namelen = name_size
+            header.msg_iov = iov_pointer
+            header.msg_iovlen = 1
+
+    def send(self, packet):
+        """
+
+        Sends packet to every recipient.
+
+        Returns:
+
+        int: how many recipients it could not be sent to (full socket buffer)
+
+        """
+        if self.messages is None:
+            return self.send_each(packet)
+
+        try:
+            # Writable buffers (a reused bytearray) are sent in place, anything else is copied once
+            buffer = (ctypes.c_char * len(packet)).from_buffer(packet)
+        except TypeError:
+            buffer = (ctypes.c_char * len(packet)).from_buffer_copy(packet)
+        self.iov.iov_base = ctypes.addressof(buffer)
+        self.iov.iov_len = len(packet)
+        fd = self.sock.fileno()
+        base = ctypes.addressof(self.messages)
+        message_size = ctypes.sizeof(_MMsgHdr)
+        count = len(self.addrs)
+        failed = 0
+        sent = 0
+        while sent < count:
+            batch = min(count - sent, MAX_BATCH)
+            result = _sendmmsg(fd, base + sent * message_size, batch, 0)
+            if result >= 0:
+                sent += result
+                continue
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                # The socket buffer is full: the rest of this broadcast is lost, like a failed sendto
+                failed += count - sent
+                break
+            if error == errno.EINTR:
+                continue
+            # The first datagram of the batch was refused: skip that recipient only
+            failed += 1
+            sent += 1
+        return failed
+
+    def send_each(self, packet):
+        sendto = self.sock.sendto
+        failed = 0
+        for addr in self.addrs:
+            try:
+                sendto(packet, addr)
+            except OSError:
+                failed += 1
+        return failed
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""
+Time of one game state broadcast as the number of watchers grows.
+
+Compares three ways of sending the same 12-byte update to every watcher:
+
+  per-client   the old publish loop: build the message and sendto per client
+  sendto-loop  one prebuilt packet, tight sendto loop (the non-Linux fallback)
+  sendmmsg     one prebuilt packet, RecipientBatch with sendmmsg batches
+
+Every watcher is a real bound UDP socket on localhost, so the kernel delivers
+the datagrams instead of answering with ICMP errors.
+
+    ./cman_broadcast_benchmark.py --watchers 10 100 1000 5000
+"""
+
+import time
+import socket
+import argparse
+from cman_game import Game, Player
+from cman_broadcast import RecipientBatch, has_sendmmsg
+
+
+def open_watchers(count):
+    watchers = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        watchers.append(sock)
+    return watchers
+
+
+def drain(watchers):
+    for sock in watchers:
+        sock.setblocking(False)
+        try:
+            while True:
+                sock.recv(64)
+        except BlockingIOError:
+            pass
+
+
+def per_client_broadcast(sock, game, clients):
+    # Mirrors the original publish_game_state_update_to_all
+    opcode = b'\x80'
+    cman_cor = bytes(game.cur_coords[Player.CMAN])
+    spirit_cor = bytes(game.cur_coords[Player.SPIRIT])
+    spirit_score = (3 - game.get_game_progress()[0]).to_bytes(1, byteorder='big')
+    collected_points = bytes(5)
+    for addr, client in clients.items():
+        player = client['player']
+        freeze = b'\x01' if player == Player.NONE or not game.can_move(player) else b'\x00'
+        try:
+            sock.sendto(opcode + freeze + cman_cor + spirit_cor + spirit_score + collected_points, addr)
+        except BlockingIOError:
+            pass
+
+
+def measure(function, rounds, watchers):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+        # Empty the receive queues so every round sees the same socket state
+        drain(watchers)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cman_server state broadcasts against watcher count")
+    parser.add_argument("-w", "--watchers", type=int, nargs="+", default=[10, 100, 1000, 5000],
+                        help="Watcher counts to measure.")
+    parser.add_argument("-r", "--rounds", type=int, default=20, help="Broadcasts per measurement (best is kept).")
+    args = parser.parse_args()
+
+    game = Game("map.txt")
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 22)
+    sender.setblocking(False)
+    packet = b'\x80\x01' + bytes(10)
+
+    if not has_sendmmsg():
+        print("sendmmsg is not available here: the sendmmsg column uses the sendto loop")
+    print(f"{'watchers':>9} {'per-client':>12} {'sendto-loop':>12} {'sendmmsg':>12} {'speedup':>8}")
+    for count in args.watchers:
+        watchers = open_watchers(count)
+        addrs = [sock.getsockname() for sock in watchers]
+        clients = {addr: {'player': Player.NONE} for addr in addrs}
+        loop = RecipientBatch(sender, addrs, use_sendmmsg=False)
+        batch = RecipientBatch(sender, addrs)
+
+        legacy = measure(lambda: per_client_broadcast(sender, game, clients), args.rounds, watchers)
+        looped = measure(lambda: loop.send(packet), args.rounds, watchers)
+        batched = measure(lambda: batch.send(packet), args.rounds, watchers)
+        print(f"{count:>9} {legacy * 1e3:>10.3f}ms {looped * 1e3:>10.3f}ms {batched * 1e3:>10.3f}ms "
+              f"{legacy / batched:>7.1f}x")
+        for sock in watchers:
+            sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,163 +2,243 @@ from typing import Tuple
 import socket
 import argparse
 import select
-import cman_utils
 from cman_game_map import read_map
+from cman_render import TerminalRenderer
 import threading
 from cman_utils import key_listener
 from cman_utils import pressed_keys as key_queue
+from cman_utils import MAX_ROOM_NAME_LENGTH
 import signal
+import time
+from collections import deque
+from cman_game import Game, Player
+from cman_reliable import backoff_delays, read_seq, SEQ
 
 KEYS_TO_HOOK = ['w', 'a', 's', 'd', 'q']
 QUIT_MESSAGE = 'q'
 DIRECTION_MAP = {'w': 0, 'a': 1, 's': 2, 'd': 3}
 ROLES = {'watcher': 0, 'cman': 1, 'spirit': 2}
+ROLE_PLAYERS = {'watcher': Player.NONE, 'cman': Player.CMAN, 'spirit': Player.SPIRIT}
 
 GAME_UPDATE_OPCODE = 0x80
+GAME_DELTA_OPCODE = 0x81
+INPUT_ACK_OPCODE = 0x82
+JOIN_ACCEPT_OPCODE = 0x83
+QUIT_ACK_OPCODE = 0x84
+ACK_OPCODE = 0x04
 GAME_END_OPCODE = 0x8F
 ERROR_OPCODE = 0xFF
 
 # Global variables
 map_data = read_map("map.txt")
 last_message = b""
-points = {}  # Track all points on the map
-last_ghost_pos = None  # Track the Ghost's previous position
+renderer = None
 server_address = None
 sock = None
 
-
-def initialize_points(map_string):
-    """
-    Initializes the points dictionary by scanning the map for all point locations.
-    """
-    global points
-    rows = map_string.split('\n')
-    points = {(r_idx, c_idx): True for r_idx, row in enumerate(rows) for c_idx, char in enumerate(row) if char == 'P'}
-
-
-def update_map(map_string, pacman_pos=None, ghost_pos=None, prev_ghost_pos=None):
-    """
-    Updates the map with new positions for Pacman ('C') and Ghost ('S'),
-    ensuring Pacman collects points and Ghost restores points when moving away.
-
-    Args:
-        map_string (str): The current map as a string.
-        pacman_pos (tuple): New position for Pacman as (row, col), optional.
-        ghost_pos (tuple): New position for Ghost as (row, col), optional.
-        prev_ghost_pos (tuple): Previous position of the Ghost, used for restoring points.
-
-    Returns:
-        str: Updated map string.
-    """
-    global points
-
-    rows = map_string.split('\n')
-
-    # Restore the point if the Ghost moved away from a point
-    if prev_ghost_pos and prev_ghost_pos in points:
-        r, c = prev_ghost_pos
-        rows[r] = rows[r][:c] + 'P' + rows[r][c + 1:]
-
-    # Clear Pacman's old position
-    if pacman_pos:
-        for r_idx, row in enumerate(rows):
-            if 'C' in row:
-                c_idx = row.index('C')
-                rows[r_idx] = row[:c_idx] + 'F' + row[c_idx + 1:]
-                break
-
-    # Clear Ghost's old position
-    if ghost_pos:
-        for r_idx, row in enumerate(rows):
-            if 'S' in row:
-                c_idx = row.index('S')
-                rows[r_idx] = row[:c_idx] + 'F' + row[c_idx + 1:]
-                break
-
-    # Update Pacman's position
-    if pacman_pos:
-        r, c = pacman_pos
-        if pacman_pos in points:
-            del points[pacman_pos]  # Pacman collects the point
-        rows[r] = rows[r][:c] + 'C' + rows[r][c + 1:]
-
-    # Update Ghost's position
-    if ghost_pos:
-        r, c = ghost_pos
-        rows[r] = rows[r][:c] + 'S' + rows[r][c + 1:]
-
-    return '\n'.join(rows)
-
-
-def print_pacman_map(attempts, collected):
-    """ Function that prints the current game map """
-    rows = map_data.split('\n')
-
-    # Define a legend for better readability
-    legend = {
-        'W': '█',  # Wall
-        'F': ' ',  # Free space
-        'P': '.',  # Dot
-        'C': 'C',  # Pacman
-        'S': 'S'  # Ghost
-    }
-
-    # Convert each row using the legend
-    for row in rows:
-        print(''.join(legend[char] for char in row))
-
-    print(f'\nAttempts left: {attempts}\nCollected points: {collected}')
-
-
-def print_game_map_to_screen(attempts, collected):
-    global map_data
-    cman_utils.clear_print()
-    print_pacman_map(attempts, collected)
+# Latest game state, kept to apply delta updates to
+last_seq = None  # Sequence number of the last applied update, None until a keyframe arrived
+pacman_coords = None
+ghost_coords = None
+spirit_score = 0
+collected_bits = 0
+keyframe_requested_at = 0.0
+KEYFRAME_REQUEST_INTERVAL = 0.5  # Seconds before asking for a keyframe again
+state_changed = False  # Whether the state changed since the last rendered frame
+
+# Receive loop
+KEY_POLL_INTERVAL = 0.01  # Longest wait for datagrams before checking the keys again
+MAX_DRAIN = 256  # Datagrams read per loop pass at most, so a flood can't starve the keys
+DEFAULT_MAX_FPS = 30
+
+# Client-side prediction: our own moves are drawn before the server confirms them
+my_player = Player.NONE
+board = None  # Game used only for its board rules, to predict where our moves lead
+input_seq = 0  # Sequence number of the last move sent
+pending_inputs = deque()  # (seq, direction, time.monotonic() sent) moves the server didn't acknowledge yet
+frozen = True  # Freeze byte of the last applied update: whether the server rejects our moves right now
+PREDICTION_TIMEOUT = 1.0  # Seconds after which an unacknowledged move is assumed lost
+
+# The server drops clients it hasn't heard from for a while, so an idle client sends keepalives
+KEEPALIVE_INTERVAL = 5.0
+last_sent_time = 0.0  # time.monotonic() of the last message sent to the server
+
+# Join, quit and the win message are delivered reliably (cman_reliable)
+joined = False  # Whether the server accepted our join; until then the join is repeated
+join_message = b""
+join_delays = None  # Backoff between repeated joins
+next_join_time = 0.0
+quit_seq = 0
+QUIT_ATTEMPTS = 3  # Quits sent before exiting without the server's ack
+
+# Delta update field mask bits
+DELTA_CMAN = 0x01
+DELTA_SPIRIT = 0x02
+DELTA_SCORE = 0x04
+DELTA_POINTS = 0x08
+POINTS_BITS = 40
 
 
 def receive_server_message(message: bytes):
     """
     Processes a message from the server.
     """
+    global joined
     opcode = message[0]
 
-
     if opcode == GAME_UPDATE_OPCODE:
+        joined = True
         handle_game_state_update(message)
+    elif opcode == GAME_DELTA_OPCODE:
+        handle_game_state_delta(message)
+    elif opcode == INPUT_ACK_OPCODE:
+        handle_input_ack(message)
+    elif opcode == JOIN_ACCEPT_OPCODE:
+        # Acked every time: a repeat means the server didn't get the previous ack
+        send_ack(message, 2)
+        joined = True
+    elif opcode == QUIT_ACK_OPCODE:
+        pass
     elif opcode == GAME_END_OPCODE:
+        send_ack(message, 4)
+        flush_pending_frame()
         handle_game_end(message)
         return True
     elif opcode == ERROR_OPCODE:
+        flush_pending_frame()
         return handle_error(message)
     else:
-        print(f"Unknown opcode received: {opcode}")
+        show_message(f"Unknown opcode received: {opcode}")
 
 
 def handle_game_state_update(message: bytes):
     """
-    Handles game state updates and updates the map accordingly.
+    Handles a full game state keyframe and updates the map accordingly.
     """
-    global map_data, last_ghost_pos
+    global last_seq, pacman_coords, ghost_coords, spirit_score, collected_bits, state_changed, frozen
+
+    seq = int.from_bytes(message[12:14], byteorder='big')
+    if last_seq is not None and (seq - last_seq) & 0xFFFF >= 0x8000:
+        # Reordered: an older keyframe would roll the state back
+        return
 
     # Extract game state details
-    can_move = message[1] == 0
+    frozen = message[1] == 1
     pacman_coords = (message[2], message[3])
     ghost_coords = (message[4], message[5])
-    attempts = 3 - message[6]
-    collected = decode_and_count_ones(message[7:])
+    spirit_score = message[6]
+    collected_bits = int.from_bytes(message[7:12], byteorder='big')
+    last_seq = seq
+    state_changed = True
 
-    # Update the map
-    try:
-        map_data = update_map(
-            map_string=map_data,
-            pacman_pos=pacman_coords,
-            ghost_pos=ghost_coords,
-            prev_ghost_pos=last_ghost_pos
-        )
-        last_ghost_pos = ghost_coords  # Update the Ghost's last position
-        print_game_map_to_screen(attempts, collected)
-    except ValueError as e:
-        print(f"Error updating map: {e}")
+
+def handle_game_state_delta(message: bytes):
+    """
+    Applies a delta update: only the fields that changed since the previous update.
+    A missing update means the delta can't be applied, so a keyframe is requested instead.
+    """
+    global last_seq, pacman_coords, ghost_coords, spirit_score, collected_bits, state_changed, frozen
+
+    seq = int.from_bytes(message[2:4], byteorder='big')
+    if last_seq is None:
+        # Joined a moment ago: the keyframe for this client is on its way
+        return
+    if (seq - last_seq) & 0xFFFF >= 0x8000 or seq == last_seq:
+        # Older than, or the same as, what we already have
+        return
+    if seq != (last_seq + 1) & 0xFFFF:
+        request_keyframe()
+        return
+
+    frozen = message[1] == 1
+    mask = message[4]
+    offset = 5
+    if mask & DELTA_CMAN:
+        pacman_coords = (message[offset], message[offset + 1])
+        offset += 2
+    if mask & DELTA_SPIRIT:
+        ghost_coords = (message[offset], message[offset + 1])
+        offset += 2
+    if mask & DELTA_SCORE:
+        spirit_score = message[offset]
+        offset += 1
+    if mask & DELTA_POINTS:
+        count = message[offset]
+        for index in message[offset + 1:offset + 1 + count]:
+            collected_bits |= 1 << (POINTS_BITS - 1 - index)
+    last_seq = seq
+    state_changed = True
+
+
+def handle_input_ack(message: bytes):
+    """
+    The server consumed every move up to this sequence number: they are in its state now
+    (or were rejected), so they are no longer replayed on top of it.
+    """
+    global state_changed
+    acked = int.from_bytes(message[1:3], byteorder='big')
+    while pending_inputs and (acked - pending_inputs[0][0]) & 0xFFFF < 0x8000:
+        pending_inputs.popleft()
+    state_changed = True
+
+
+def predicted_state():
+    """
+    Returns the latest authoritative state with our unacknowledged moves replayed on top of it,
+    as (cman coords, spirit coords, collected bitmap). A move the server saw differently is
+    corrected by the next update, since that becomes the base the remaining moves are replayed on.
+    """
+    # An acknowledgement that never arrived must not keep a move replayed forever
+    expired = time.monotonic() - PREDICTION_TIMEOUT
+    while pending_inputs and pending_inputs[0][2] < expired:
+        pending_inputs.popleft()
+
+    coords = [pacman_coords, ghost_coords]
+    bits = collected_bits
+    position = coords[my_player] if my_player != Player.NONE else None
+    if not pending_inputs or position is None:
+        return pacman_coords, ghost_coords, collected_bits
+    for _, direction, _ in pending_inputs:
+        moved = board.peek_move(position, direction)
+        if moved is None:
+            continue
+        position = moved
+        if my_player == Player.CMAN:
+            bits |= board.point_bits.get(position, 0)
+    coords[my_player] = position
+    return coords[0], coords[1], bits
+
+
+def render_game_state():
+    global state_changed
+    state_changed = False
+    cman, spirit, bits = predicted_state()
+    attempts = 3 - spirit_score
+    collected = bin(bits).count('1')
+    renderer.render(cman, spirit, bits, attempts, collected)
+
+
+def show_message(text: str):
+    # In the renderer's message rows: printing would scroll the map out from under the diff frames
+    if renderer is None:
+        print(text)
+    else:
+        renderer.message(text)
+
+
+def flush_pending_frame():
+    # Draws a state still waiting for its frame, so printed messages end up under the newest map
+    if state_changed:
+        render_game_state()
+
+
+def request_keyframe():
+    global keyframe_requested_at
+    now = time.monotonic()
+    if now - keyframe_requested_at < KEYFRAME_REQUEST_INTERVAL:
+        return
+    keyframe_requested_at = now
+    send_to_server(bytes([0x02]))
 
 
 def handle_game_end(message: bytes):
@@ -167,81 +247,183 @@ def handle_game_end(message: bytes):
     cman_points_collected = message[3]
 
     winner = "cman" if cman_won else "spirit"
-    print(f"Winner is: {winner}\nSpirit score: {cman_num_caught}\nCman score: {cman_points_collected}")
+    show_message(f"Winner is: {winner}\nSpirit score: {cman_num_caught}\nCman score: {cman_points_collected}")
 
 
 def handle_error(message: bytes):
     error_data = message[1:12].rstrip(b'\x00')
     error_data = error_data.decode('utf-8')
     if error_data == "0":
-        print("Player cannot move in this state of the game")
+        show_message("Player cannot move in this state of the game")
         return False
     if error_data == "1":
-        print("invalid join message")
+        show_message("invalid join message")
         return True        
     if error_data == "2":
-        print("User already joined")
+        show_message("User already joined")
         return True   
     if error_data == "3":
-        print("Active player cant join - Game already started")
+        show_message("Active player cant join - Game already started")
         return True   
     if error_data == "4":
-        print("Cman cant join - already occupied")
+        show_message("Cman cant join - already occupied")
         return True   
     if error_data == "5":
-        print("Spirit cant join - already occupied")
+        show_message("Spirit cant join - already occupied")
         return True   
     if error_data == "6":
-        print("Cant join -  Invalid role")
+        show_message("Cant join -  Invalid role")
         return True   
     if error_data == "7":
-        print("movement detected from an unknown user")
+        show_message("movement detected from an unknown user")
         return True   
     if error_data == "8":
-        print("Invalid movement message")
+        show_message("Invalid movement message")
         return False   
     if error_data == "9":
-        print("Invalid direction in movement message")
+        show_message("Invalid direction in movement message")
         return False   
     if error_data == "10":
-        print("Watcher can't move")
+        show_message("Watcher can't move")
         return False   
     if error_data == "11":
-        print("Quit message or timedout from unknown user")
+        show_message("Quit message or timedout from unknown user")
         return True
     if error_data == "12":
-        print("Invalid quit message: should be only opcode")
+        show_message("Invalid quit message: should be only opcode")
         return True   
+    if error_data == "13":
+        show_message("Keyframe request from an unknown user")
+        return True
+    if error_data == "14":
+        show_message("Invalid keyframe request: should be only opcode")
+        return False
+    if error_data == "15":
+        show_message("Keepalive from an unknown user")
+        return True
+    if error_data == "16":
+        show_message("Invalid keepalive message: should be only opcode")
+        return False
+    if error_data == "17":
+        show_message("Disconnected by the server: idle for too long")
+        return True
+    if error_data == "18":
+        show_message("Invalid ack message: should be opcode and sequence number")
+        return False
     else:
-        print("Unknown error")
+        show_message("Unknown error")
         return True
 
-def send_join_message(role: int):
-    global sock, server_address
-    join_message = bytes([0x00, role])
-    sock.sendto(join_message, server_address)
+
+def drain_server_messages():
+    """
+    Reads and applies every datagram waiting on the socket, up to MAX_DRAIN.
+    Returns True when one of them ends the client.
+    """
+    for _ in range(MAX_DRAIN):
+        try:
+            data, _ = sock.recvfrom(1024)
+        except BlockingIOError:
+            return False
+        if receive_server_message(data):
+            return True
+    return False
+
+
+def handle_pressed_keys():
+    while not key_queue.empty():
+        key = key_queue.get()
+        if key == QUIT_MESSAGE:
+            send_quit_message()
+
+        if key in DIRECTION_MAP:
+            send_move_message(DIRECTION_MAP[key])
+
+
+def send_to_server(message: bytes):
+    global last_sent_time
+    sock.sendto(message, server_address)
+    last_sent_time = time.monotonic()
+
+
+def send_keepalive_if_idle():
+    if time.monotonic() - last_sent_time >= KEEPALIVE_INTERVAL:
+        send_to_server(bytes([0x03]))
+
+
+def send_ack(message: bytes, plain_length: int):
+    # A reliable message is the plain message followed by its sequence number, the ack echoes it
+    if len(message) == plain_length + SEQ.size:
+        send_to_server(bytes([ACK_OPCODE]) + SEQ.pack(read_seq(message)))
+
+
+def send_join_message(role: int, room: str = ""):
+    global join_message, join_delays, next_join_time
+    join_message = bytes([0x00, role]) + room.encode()
+    join_delays = backoff_delays()
+    next_join_time = 0.0
+    return repeat_join()
+
+
+def repeat_join():
+    """
+    Sends the join again, with growing delays, until the server accepts it.
+    Returns True when the server never answered.
+    """
+    global next_join_time
+    if joined or time.monotonic() < next_join_time:
+        return False
+    delay = next(join_delays, None)
+    if delay is None:
+        show_message("No answer from the server")
+        return True
+    send_to_server(join_message)
+    next_join_time = time.monotonic() + delay
+    return False
 
 
 def send_quit_message(signum=None, frame=None):
-    global sock, server_address
-    quit_message = bytes([0x0F])
-    sock.sendto(quit_message, server_address)
-    print("Quit message sent to server.")
+    global quit_seq
+    # Repeated until the server acks it or QUIT_ATTEMPTS sends went unanswered
+    quit_seq = (quit_seq + 1) & 0xFFFF
+    quit_message = bytes([0x0F]) + SEQ.pack(quit_seq)
+    for delay in backoff_delays(QUIT_ATTEMPTS):
+        send_to_server(quit_message)
+        if wait_for_quit_ack(delay):
+            break
+    show_message("Quit message sent to server.")
     exit(0)
+
+
+def wait_for_quit_ack(timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        readable, _, _ = select.select([sock], [], [], remaining)
+        if not readable:
+            return False
+        try:
+            data, _ = sock.recvfrom(1024)
+        except BlockingIOError:
+            continue
+        # Everything else is of no interest anymore
+        if data[0] == QUIT_ACK_OPCODE and len(data) == 1 + SEQ.size and read_seq(data) == quit_seq:
+            return True
     
 
 
 def send_move_message(direction: int):
-    global sock, server_address
-    move_message = bytes([0x01, direction])
-    sock.sendto(move_message, server_address)
-
+    global sock, server_address, input_seq, state_changed
+    input_seq = (input_seq + 1) & 0xFFFF
+    move_message = bytes([0x01, direction]) + input_seq.to_bytes(2, byteorder='big')
+    send_to_server(move_message)
+    if my_player != Player.NONE and not frozen and last_seq is not None:
+        # Drawn on the next frame, the server's acknowledgement later retires it
+        pending_inputs.append((input_seq, direction, time.monotonic()))
+        state_changed = True
 
-def decode_and_count_ones(encoded_points):
-    integer_value = int.from_bytes(encoded_points, byteorder='big')
-    binary_string = bin(integer_value)[2:].zfill(40)  # Ensure it's 40 bits long
-    ones_count = binary_string.count('1')
-    return ones_count
 
 def set_signal_handlers():
     signal.signal(signal.SIGINT, send_quit_message)  
@@ -249,56 +431,75 @@ def set_signal_handlers():
     signal.signal(signal.SIGHUP, send_quit_message) 
 def main():
     set_signal_handlers()
-    global map_data, points, last_ghost_pos, server_address, sock
+    global renderer, server_address, sock, my_player, board
 
     # Argument parsing
     parser = argparse.ArgumentParser(description="Cman Game Client")
     parser.add_argument("role", choices=["cman", "spirit", "watcher"], help="Role to play: cman, spirit, or watcher.")
     parser.add_argument("addr", help="Server address (IP or hostname).")
     parser.add_argument("-p", "--port", type=int, default=1337, help="Server port (default: 1337).")
+    parser.add_argument("-r", "--room", default="", help="Name of the game room to join (default: the default room).")
+    parser.add_argument("--max-fps", type=float, default=DEFAULT_MAX_FPS,
+                        help=f"Most frames drawn per second (default: {DEFAULT_MAX_FPS}).")
     args = parser.parse_args()
+    if len(args.room.encode()) > MAX_ROOM_NAME_LENGTH:
+        parser.error(f"room name must be at most {MAX_ROOM_NAME_LENGTH} bytes")
+    if args.max_fps <= 0:
+        parser.error("--max-fps must be positive")
 
     role = args.role
     server_address = (args.addr, args.port) 
     
 
-    # Initialize points dictionary
-    initialize_points(map_data)
+    renderer = TerminalRenderer(map_data)
+    my_player = ROLE_PLAYERS[role]
+    if my_player != Player.NONE:
+        board = Game("map.txt")
 
     # Create a UDP socket
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
 
     key_thread = threading.Thread(target=key_listener, args=(KEYS_TO_HOOK,), daemon=True)
     key_thread.start()
 
-    print("connecting to server...")
+    show_message("connecting to server...")
 
     try:
-        send_join_message(ROLES[role])
+        if send_join_message(ROLES[role], args.room):
+            return
 
+        frame_interval = 1 / args.max_fps
+        next_frame_time = 0.0
         while True:
-            # Process server updates
-            readable, _, _ = select.select([sock], [], [], 0.05)
-            if sock in readable:
-                data, _ = sock.recvfrom(1024)
-                if receive_server_message(data):
-                    break
-
-            # Check for user input
-            while not key_queue.empty():
-                key = key_queue.get()
-                if key == QUIT_MESSAGE:
-                    send_quit_message()
-
-                if key in DIRECTION_MAP:
-                    send_move_message(DIRECTION_MAP[key])
+            # Keys are handled first and between every step, so input never waits for a frame
+            handle_pressed_keys()
+
+            now = time.monotonic()
+            timeout = KEY_POLL_INTERVAL
+            if state_changed:
+                timeout = min(timeout, max(0.0, next_frame_time - now))
+            readable, _, _ = select.select([sock], [], [], timeout)
+            if sock in readable and drain_server_messages():
+                break
+
+            handle_pressed_keys()
+            if repeat_join():
+                break
+            send_keepalive_if_idle()
+
+            # Every update was applied, but only the newest state is drawn, at most max_fps times a second
+            now = time.monotonic()
+            if state_changed and now >= next_frame_time:
+                render_game_state()
+                next_frame_time = now + frame_interval
 
     except KeyboardInterrupt:
         send_quit_message()
-        print("Exiting due to user interrupt.")
+        show_message("Exiting due to user interrupt.")
     except Exception as e:
-        print(f"Exception: {e}")
+        show_message(f"Exception: {e}")
     finally:
         sock.close()
 
@@ -1,10 +1,18 @@
 import cman_game_map as gm
 import os
+from array import array
 from enum import IntEnum
+from cman_log import get_logger
+
+log = get_logger('cman_game')
 
 MAX_ATTEMPTS = 3
 WIN_SCORE = 32
 
+# Neighbour table entries for moves that don't lead to a cell
+MOVE_WALL = -1
+MOVE_OUT_OF_BOUNDS = -2
+
 class Player(IntEnum):
 	NONE = -1	# Error value for functions returning a Player value.
 	CMAN = 0
@@ -16,17 +24,20 @@ class Direction(IntEnum):
 	DOWN = 2
 	RIGHT = 3
 
+# (row, column) offset of a move in each Direction
+DIRECTION_OFFSETS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+
 class State(IntEnum):
 	WAIT = 0	# Game may not start yet
 	START = 1	# Round may start
 	PLAY = 2	# Round has started
 	WIN = 3		# Game ended
 
-class Game():
+class Board():
 	def __init__(self, map_path):
 		"""
 
-		Creates a new game instance.
+		Loads a map and precomputes its static tables. A board never changes, so every game on the map can share one.
 
 		Parameters:
 
@@ -34,17 +45,77 @@ class Game():
 
 		"""
 		assert os.path.isfile(map_path), "map file does not exist."
-		self.board = gm.read_map(map_path).split('\n')
-		self.board_dims = (len(self.board), len(self.board[0]))
+		self.rows = gm.read_map(map_path).split('\n')
+		self.dims = (len(self.rows), len(self.rows[0]))
 
 		self.start_coords = []
 		for p_char in gm.PLAYER_CHARS:
-			start_row = [p_char in row for row in self.board].index(True)
-			self.start_coords.append((start_row, self.board[start_row].index(p_char)))
+			start_row = [p_char in row for row in self.rows].index(True)
+			self.start_coords.append((start_row, self.rows[start_row].index(p_char)))
+
+		self.point_coords = [(i,j) for i in range(self.dims[0])
+								   for j in range(self.dims[1])
+								   if self.rows[i][j] == gm.POINT_CHAR]
+		# Bit of each point in the collected points bitmap: points in (row, column) order, the first one is the most significant of gm.MAX_POINTS bits
+		self.point_bits = {point: 1 << (gm.MAX_POINTS - 1 - i) for i, point in enumerate(sorted(self.point_coords))}
+		self.build_move_tables()
+
+	def build_move_tables(self):
+		"""
+
+		Flattens the board into cells (cell id = row * width + column) and precomputes everything a move needs,
+		so apply_move is a handful of table lookups.
+
+		"""
+		rows, cols = self.dims
+		self.cell_coords = [(i, j) for i in range(rows) for j in range(cols)]
+		self.passable = bytearray(char in gm.PASS_CHARS for row in self.rows for char in row)
+
+		# neighbours[cell * 4 + direction] is the cell a move leads to, or MOVE_WALL / MOVE_OUT_OF_BOUNDS
+		self.neighbours = array('i')
+		for i, j in self.cell_coords:
+			for dr, dc in DIRECTION_OFFSETS:
+				r, c = i + dr, j + dc
+				if r < 0 or c < 0 or r >= rows or c >= cols:
+					self.neighbours.append(MOVE_OUT_OF_BOUNDS)
+				elif not self.passable[r * cols + c]:
+					self.neighbours.append(MOVE_WALL)
+				else:
+					self.neighbours.append(r * cols + c)
+
+		# Collected points bitmap bit of the point on each cell, 0 for cells without one
+		self.cell_point_bits = [0] * (rows * cols)
+		for (i, j), bit in self.point_bits.items():
+			self.cell_point_bits[i * cols + j] = bit
+		self.start_cells = [i * cols + j for i, j in self.start_coords]
+
+class Game():
+	def __init__(self, map_path, board=None):
+		"""
+
+		Creates a new game instance.
+
+		Parameters:
+
+		map_path (str): a path to the textual map file
+
+		board (Board): the map already loaded, shared with other games; loaded from map_path when None
 
-		self.points = {(i,j):1 for i in range(self.board_dims[0])
-							   for j in range(self.board_dims[1])
-							   if self.board[i][j] == gm.POINT_CHAR}
+		"""
+		if board is None:
+			board = Board(map_path)
+		# The static tables are shared with the board, only the game state below is per game
+		self.board = board.rows
+		self.board_dims = board.dims
+		self.start_coords = board.start_coords
+		self.point_bits = board.point_bits
+		self.cell_coords = board.cell_coords
+		self.passable = board.passable
+		self.neighbours = board.neighbours
+		self.cell_point_bits = board.cell_point_bits
+		self.start_cells = board.start_cells
+
+		self.points = {point: 1 for point in board.point_coords}
 		self.restart_game()
 
 	def restart_game(self):
@@ -54,9 +125,11 @@ class Game():
 
 		"""
 		self.cur_coords = self.start_coords[::]
+		self.cur_cells = self.start_cells[::]
 		self.score = 0
 		for p in self.points.keys():
 			self.points[p] = 1
+		self.collected_mask = 0
 		self.lives = MAX_ATTEMPTS
 		self.state = State.WAIT
 		self.winner = None
@@ -68,6 +141,7 @@ class Game():
 
 		"""
 		self.cur_coords = self.start_coords[::]
+		self.cur_cells = self.start_cells[::]
 		self.state = State.START
 
 	def get_current_players_coords(self):
@@ -102,6 +176,18 @@ class Game():
 		"""
 		return self.points
 
+	def get_collected_mask(self):
+		"""
+		
+		Returns:
+
+		int: A bitmap of the collected points in this game instance, gm.MAX_POINTS bits wide
+
+		The points are ordered by their (row, column) coordinates and the first one is the most significant bit. Collected points are 1, uncollected are 0
+
+		"""
+		return self.collected_mask
+
 	def get_winner(self):
 		"""
 		
@@ -150,6 +236,28 @@ class Game():
 		"""
 		return (self.state == State.PLAY or (self.state == State.START and player == Player.CMAN))
 
+	def peek_move(self, coords, direction):
+		"""
+
+		Looks up where a single movement leads on the board alone, without the game state, the other player or points.
+		Used by clients to predict their own moves before the server confirms them.
+
+		Parameters:
+
+		coords (tuple(int, int)): The (row, column) the move starts from
+
+		direction (Direction): The direction of movement
+
+		Returns:
+
+		tuple(int, int): The coordinates after the move, or None if a wall or the board's edge blocks it
+
+		"""
+		next_cell = self.neighbours[(coords[0] * self.board_dims[1] + coords[1]) * 4 + direction]
+		if next_cell < 0:
+			return None
+		return self.cell_coords[next_cell]
+
 	def apply_move(self, player, direction):
 		"""
 		
@@ -167,29 +275,34 @@ class Game():
 
 		"""
 		if not self.can_move(player):
-			print("Player f{player} cannot move in this state of the game.")
+			log.debug("player cannot move in this state of the game", sample=100, player=player)
 			return False
 
-		p_coords = self.cur_coords[player]
-		dr = -1 if direction == Direction.UP else 1 if direction == Direction.DOWN else 0
-		dc = -1 if direction == Direction.LEFT else 1 if direction == Direction.RIGHT else 0
-		next_coords = (p_coords[0] + dr, p_coords[1] + dc)
+		cell = self.cur_cells[player]
+		# Anything but a Direction leaves the player in place, like a zero offset would
+		next_cell = self.neighbours[cell * 4 + direction] if 0 <= direction < 4 else cell
 
-		if any(x < 0 for x in next_coords) or next_coords[0] >= self.board_dims[0] or next_coords[1] >= self.board_dims[1]:
-			print(f"Player {player} tried to move out of bounds.")
+		if next_cell == MOVE_OUT_OF_BOUNDS:
+			log.debug("player tried to move out of bounds", sample=100, player=player)
 			return False
-		if self.board[next_coords[0]][next_coords[1]] not in gm.PASS_CHARS:
-			print(f"Player {player} tried to move into a wall.")
+		if next_cell == MOVE_WALL:
+			log.debug("player tried to move into a wall", sample=100, player=player)
 			return False
 		else:
 			self.state = State.PLAY
+			next_coords = self.cell_coords[next_cell]
+			self.cur_cells[player] = next_cell
 			self.cur_coords[player] = next_coords
-			if player == Player.CMAN and next_coords in self.points.keys():
-				self.score += self.points[next_coords]
-				self.points[next_coords] = 0
-				if self.score >= WIN_SCORE:
-					self.declare_winner(Player.CMAN)
-			if (player == Player.CMAN and next_coords in self.cur_coords[1:]) or (player != Player.CMAN and next_coords == self.cur_coords[0]):
+			if player == Player.CMAN:
+				bit = self.cell_point_bits[next_cell]
+				if bit:
+					if not self.collected_mask & bit:
+						self.score += 1
+						self.points[next_coords] = 0
+						self.collected_mask |= bit
+					if self.score >= WIN_SCORE:
+						self.declare_winner(Player.CMAN)
+			if next_cell == self.cur_cells[1 if player == Player.CMAN else 0]:
 				self.lives -= 1
 				if self.lives <= 0:
 					self.declare_winner(Player.SPIRIT)
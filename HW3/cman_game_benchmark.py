@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""
+Moves per second of Game.apply_move against the original list-of-strings engine.
+
+LegacyGame below is the previous apply_move, kept here as the reference. Both
+engines replay the same random move sequence, first checking that they end
+up in the same state after every move, then timing it.
+
+    ./cman_game_benchmark.py --moves 200000
+"""
+
+import time
+import random
+import argparse
+import cman_game_map as gm
+from cman_game import Game, Player, Direction, State, WIN_SCORE, log
+
+
+class LegacyGame(Game):
+    def apply_move(self, player, direction):
+        if not self.can_move(player):
+            log.debug("player cannot move in this state of the game", sample=100, player=player)
+            return False
+
+        p_coords = self.cur_coords[player]
+        dr = -1 if direction == Direction.UP else 1 if direction == Direction.DOWN else 0
+        dc = -1 if direction == Direction.LEFT else 1 if direction == Direction.RIGHT else 0
+        next_coords = (p_coords[0] + dr, p_coords[1] + dc)
+
+        if any(x < 0 for x in next_coords) or next_coords[0] >= self.board_dims[0] or next_coords[1] >= self.board_dims[1]:
+            log.debug("player tried to move out of bounds", sample=100, player=player)
+            return False
+        if self.board[next_coords[0]][next_coords[1]] not in gm.PASS_CHARS:
+            log.debug("player tried to move into a wall", sample=100, player=player)
+            return False
+        else:
+            self.state = State.PLAY
+            self.cur_coords[player] = next_coords
+            if player == Player.CMAN and next_coords in self.points.keys():
+                self.score += self.points[next_coords]
+                self.points[next_coords] = 0
+                if self.score >= WIN_SCORE:
+                    self.declare_winner(Player.CMAN)
+            if (player == Player.CMAN and next_coords in self.cur_coords[1:]) or (player != Player.CMAN and next_coords == self.cur_coords[0]):
+                self.lives -= 1
+                if self.lives <= 0:
+                    self.declare_winner(Player.SPIRIT)
+                else:
+                    self.next_round()
+            return True
+
+
+def random_moves(count, seed):
+    # Mostly C-Man moves, so games run long enough to collect points and end
+    rng = random.Random(seed)
+    return [(Player.CMAN if rng.random() < 0.7 else Player.SPIRIT, rng.randrange(4)) for _ in range(count)]
+
+
+def snapshot(game):
+    return (list(game.cur_coords), game.score, game.lives, game.state, game.get_winner(), dict(game.points))
+
+
+def replay(game, moves, record=False):
+    game.next_round()
+    results = []
+    for player, direction in moves:
+        if game.state == State.WIN:
+            game.restart_game()
+            game.next_round()
+        changed = game.apply_move(player, direction)
+        if record:
+            results.append((changed, snapshot(game)))
+    return results
+
+
+def moves_per_second(game, moves):
+    start = time.perf_counter()
+    replay(game, moves)
+    return len(moves) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Game.apply_move against the original engine")
+    parser.add_argument("-n", "--moves", type=int, default=200000, help="Moves to time per engine.")
+    parser.add_argument("--check", type=int, default=20000, help="Moves compared state-by-state first.")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    check_moves = random_moves(args.check, args.seed)
+    legacy = replay(LegacyGame("map.txt"), check_moves, record=True)
+    current = replay(Game("map.txt"), check_moves, record=True)
+    mismatch = next((i for i, (a, b) in enumerate(zip(legacy, current)) if a != b), None)
+    if mismatch is not None:
+        print(f"MISMATCH after move {mismatch}: {check_moves[mismatch]}")
+        print(f"  legacy:  {legacy[mismatch]}")
+        print(f"  current: {current[mismatch]}")
+        raise SystemExit(1)
+    print(f"engines agree on {args.check} moves")
+
+    moves = random_moves(args.moves, args.seed + 1)
+    legacy_rate = moves_per_second(LegacyGame("map.txt"), moves)
+    current_rate = moves_per_second(Game("map.txt"), moves)
+    print(f"legacy:  {legacy_rate:>12,.0f} moves/s")
+    print(f"current: {current_rate:>12,.0f} moves/s  ({current_rate / legacy_rate:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
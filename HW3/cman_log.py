@@ -0,0 +1,25 @@
+"""
+Logging for the cman server and game engine.
+
+The implementation lives in common/structured_log.py and is shared with the
+HW1 numbers server; this module only makes it importable when a cman script
+runs from HW3/. The loggers used here are 'cman_server', 'cman_game' and
+'cman_reliable'.
+
+Usage:
+    setup_logging('INFO')
+    log = get_logger('cman_server')
+    log.info("client joined", addr=addr, role=role)
+    log.debug("invalid move", sample=100, player=player)
+"""
+
+import os
+import sys
+
+# common/ sits next to HW3/. Appended, not prepended: the repo root also holds
+# the original numbers_server.py and Connection.py, which must not shadow HW1's
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.structured_log import get_logger, setup_logging, shutdown_logging
+
+__all__ = ['get_logger', 'setup_logging', 'shutdown_logging']
@@ -0,0 +1,171 @@
+"""
+Reliable delivery for the few cman messages that must arrive: join results,
+the win message and quits. Movement and state updates stay plain datagrams,
+a lost one is replaced by the next.
+
+A reliable message is the plain message followed by a 2-byte sequence
+number. The receiver answers with an ack carrying that number (0x04 + seq
+from a client). Until every recipient acked, the message is retransmitted
+to the ones that didn't, waiting twice as long each time, and given up on
+after MAX_ATTEMPTS sends.
+
+Usage:
+    reliable = ReliableSender(server_socket, scheduler)
+    reliable.send([addr], b'\\x83\\x01')
+    ...
+    reliable.ack(addr, seq)  # on 0x04 from addr
+"""
+
+import struct
+from cman_log import get_logger
+
+log = get_logger('cman_reliable')
+
+# Trailer of a reliable message, and the body of an ack
+SEQ = struct.Struct('>H')
+
+# Retransmission: first wait, longest wait, and sends before giving up
+INITIAL_TIMEOUT = 0.2
+MAX_TIMEOUT = 2.0
+MAX_ATTEMPTS = 8
+
+
+def backoff_delays(attempts=MAX_ATTEMPTS, initial=INITIAL_TIMEOUT, maximum=MAX_TIMEOUT):
+    # Seconds to wait for an ack after each of the attempts sends
+    delay = initial
+    for _ in range(attempts):
+        yield delay
+        delay = min(delay * 2, maximum)
+
+
+def with_seq(message, seq):
+    return message + SEQ.pack(seq)
+
+
+def read_seq(data):
+    # Sequence number at the end of a reliable message or in an ack body
+    return SEQ.unpack_from(data, len(data) - SEQ.size)[0]
+
+
+class _Pending:
+    __slots__ = ('seq', 'packet', 'addrs', 'delays', 'timer', 'on_done')
+
+    def __init__(self, seq, packet, addrs, on_done):
+        self.seq = seq
+        self.packet = packet
+        self.addrs = addrs          # Recipients that didn't ack yet
+        self.delays = backoff_delays()
+        self.timer = None           # Scheduled retransmission
+        self.on_done = on_done      # Called once everyone acked or the message was given up on
+
+
+class ReliableSender:
+    def __init__(self, sock, scheduler):
+        """
+
+        Parameters:
+
+        sock (socket.socket): the non-blocking datagram socket to send from
+
+        scheduler (Scheduler): runs the retransmission timers
+
+        """
+        self.sock = sock
+        self.scheduler = scheduler
+        self.next_seq = 0
+        self.pending = {}  # seq -> _Pending
+
+    def send(self, addrs, message, first_send=None, on_done=None):
+        """
+
+        Sends one message to every address until each acked it. The same sequence number
+        is used for all of them, so the packet is built once.
+
+        Parameters:
+
+        addrs (iterable(tuple(str, int))): the recipients
+
+        message (bytes): the plain message; the sequence number is appended to it
+
+        first_send (callable): sends the first copy to everyone, e.g. as a batch; unicast by default
+
+        on_done (callable): called from the scheduler once every recipient acked or was given up on
+
+        Returns:
+
+        int: the message's sequence number
+
+        """
+        seq = self.next_seq
+        self.next_seq = (seq + 1) & 0xFFFF
+        pending = _Pending(seq, with_seq(message, seq), set(addrs), on_done)
+        if not pending.addrs:
+            self.finish(pending)
+            return seq
+        self.pending[seq] = pending
+        if first_send is not None:
+            first_send(pending.packet)
+        else:
+            self.send_each(pending)
+        pending.timer = self.scheduler.call_later(next(pending.delays), self.retransmit, pending)
+        return seq
+
+    def ack(self, addr, seq):
+        """
+
+        Records that addr received message seq.
+
+        Returns:
+
+        bool: whether the ack matched a message still waiting for addr
+
+        """
+        pending = self.pending.get(seq)
+        if pending is None or addr not in pending.addrs:
+            return False
+        pending.addrs.discard(addr)
+        if not pending.addrs:
+            self.complete(pending)
+        return True
+
+    def forget(self, addr):
+        """
+
+        Stops retransmitting anything to addr, e.g. because it left.
+
+        """
+        for pending in list(self.pending.values()):
+            if addr in pending.addrs:
+                pending.addrs.discard(addr)
+                if not pending.addrs:
+                    self.complete(pending)
+
+    def retransmit(self, pending):
+        delay = next(pending.delays, None)
+        if delay is None:
+            log.info("giving up on reliable message", seq=pending.seq, unacked=len(pending.addrs))
+            self.complete(pending)
+            return
+        log.debug("retransmitting reliable message", sample=100, seq=pending.seq, unacked=len(pending.addrs))
+        self.send_each(pending)
+        pending.timer = self.scheduler.call_later(delay, self.retransmit, pending)
+
+    def send_each(self, pending):
+        sendto = self.sock.sendto
+        for addr in pending.addrs:
+            try:
+                sendto(pending.packet, addr)
+            except OSError:
+                # Counts as lost: the next retransmission covers it
+                pass
+
+    def complete(self, pending):
+        del self.pending[pending.seq]
+        if pending.timer is not None:
+            pending.timer.cancel()
+        self.finish(pending)
+
+    def finish(self, pending):
+        # From the scheduler, so callers of send/ack/forget never see on_done run inside them
+        if pending.on_done is not None:
+            self.scheduler.call_later(0, pending.on_done)
@@ -0,0 +1,155 @@
+"""
+Draws the cman map to an ANSI terminal, rewriting only the cells that changed.
+
+The renderer keeps the map as a flat array of cell characters and remembers
+what is currently on the screen. The first frame clears the screen and draws
+everything. Every later frame compares the new cells with the screen and emits
+a cursor move plus glyph for each changed cell only. The whole frame goes out
+in a single write, so the terminal never shows a half-drawn map and a frame
+costs a few bytes instead of the whole board.
+
+Text for the player goes through message(), into rows under the status
+lines that the renderer owns. Printing it directly would scroll the terminal
+and every later frame would land on the wrong rows.
+
+Usage:
+    renderer = TerminalRenderer(map_data)
+    renderer.render(cman_coords, spirit_coords, collected_bits, attempts, collected)
+    renderer.message("Watcher can't move")
+"""
+
+import sys
+from cman_game_map import MAX_POINTS
+
+# Terminal glyph of every map character
+LEGEND = {
+    'W': '█',  # Wall
+    'F': ' ',  # Free space
+    'P': '.',  # Dot
+    'C': 'C',  # Pacman
+    'S': 'S'   # Ghost
+}
+
+CLEAR_SCREEN = "\033[H\033[J"
+CLEAR_LINE = "\033[K"
+
+
+def cursor_to(row, col):
+    # ANSI positions are 1-based
+    return f"\033[{row + 1};{col + 1}H"
+
+
+class TerminalRenderer:
+    def __init__(self, map_string, stream=None):
+        """
+
+        Parameters:
+
+        map_string (str): the map as read by read_map, one row per line
+
+        stream (file): where frames are written, sys.stdout by default
+
+        """
+        rows = map_string.split('\n')
+        self.height = len(rows)
+        self.width = len(rows[0])
+        self.stream = stream if stream is not None else sys.stdout
+
+        # The players are drawn over the static map, so their start cells are free space
+        self.base = ['F' if char in 'CS' else char for row in rows for char in row]
+        # Point cells in the server's bit order: points are numbered row by row
+        point_cells = [cell for cell, char in enumerate(self.base) if char == 'P']
+        self.point_bits = [(cell, 1 << (MAX_POINTS - 1 - i)) for i, cell in enumerate(point_cells)]
+
+        # Prerendered "move the cursor there and draw it" string of every cell and character
+        self.cell_glyphs = [{char: cursor_to(cell // self.width, cell % self.width) + glyph
+                             for char, glyph in LEGEND.items()}
+                            for cell in range(len(self.base))]
+        self.status_cursor = cursor_to(self.height + 1, 0)
+        self.message_row = self.height + 3
+
+        self.screen = None  # Cells currently on the terminal, None before the first frame
+        self.status = None  # Status lines currently on the terminal
+        self.message_lines = 0  # Lines of the message currently on the terminal
+
+    def build_cells(self, cman_coords, spirit_coords, collected_bits):
+        cells = self.base[:]
+        for cell, bit in self.point_bits:
+            if collected_bits & bit:
+                cells[cell] = 'F'
+        if cman_coords is not None:
+            cells[cman_coords[0] * self.width + cman_coords[1]] = 'C'
+        if spirit_coords is not None:
+            # Drawn last: a spirit that caught the cman is the one shown
+            cells[spirit_coords[0] * self.width + spirit_coords[1]] = 'S'
+        return cells
+
+    def render(self, cman_coords, spirit_coords, collected_bits, attempts, collected):
+        """
+
+        Draws one frame: the map with both players on it and the status lines under it.
+
+        Parameters:
+
+        cman_coords (tuple(int, int)): the cman's (row, col), None to leave it out
+
+        spirit_coords (tuple(int, int)): the spirit's (row, col), None to leave it out
+
+        collected_bits (int): the collected points bitmap sent by the server
+
+        attempts (int): attempts the cman has left
+
+        collected (int): points the cman collected
+
+        """
+        cells = self.build_cells(cman_coords, spirit_coords, collected_bits)
+        out = []
+        if self.screen is None:
+            out.append(CLEAR_SCREEN)
+            self.message_lines = 0
+            out.extend(''.join(LEGEND[char] for char in cells[start:start + self.width]) + '\n'
+                       for start in range(0, len(cells), self.width))
+        else:
+            cell_glyphs = self.cell_glyphs
+            out.extend(cell_glyphs[cell][new] for cell, (new, old) in enumerate(zip(cells, self.screen))
+                       if new != old)
+
+        status = (attempts, collected)
+        if status != self.status:
+            out.append(f"{self.status_cursor}Attempts left: {attempts}{CLEAR_LINE}\n"
+                       f"Collected points: {collected}{CLEAR_LINE}")
+            self.status = status
+
+        if len(out) > 0:
+            out.append(self.park_cursor())
+            self.stream.write(''.join(out))
+            self.stream.flush()
+        self.screen = cells
+
+    def message(self, text):
+        """
+
+        Shows text under the status lines, replacing the previous message.
+
+        Parameters:
+
+        text (str): the message, may span several lines
+
+        """
+        if self.screen is None:
+            # Nothing drawn yet, and the first frame clears the screen anyway
+            self.stream.write(text + '\n')
+            self.stream.flush()
+            return
+        lines = text.split('\n')
+        out = [cursor_to(self.message_row + i, 0) + line + CLEAR_LINE for i, line in enumerate(lines)]
+        # Rows a longer previous message left behind
+        out.extend(cursor_to(self.message_row + i, 0) + CLEAR_LINE for i in range(len(lines), self.message_lines))
+        self.message_lines = len(lines)
+        out.append(self.park_cursor())
+        self.stream.write(''.join(out))
+        self.stream.flush()
+
+    def park_cursor(self):
+        # Under the message, so the shell prompt doesn't land on the map when the client exits
+        return cursor_to(self.message_row + self.message_lines, 0)
@@ -0,0 +1,142 @@
+import time
+from collections import deque
+from cman_game import Player, Game
+
+# Order in which queued moves are applied within a tick
+MOVE_ORDER = (Player.CMAN, Player.SPIRIT)
+
+class Room():
+	def __init__(self, name, map_path, board=None):
+		"""
+
+		Creates a new room: one game with its own players and watchers.
+
+		Parameters:
+
+		name (str): the name clients join the room by
+
+		map_path (str): a path to the textual map file
+
+		board (Board): the map already loaded, shared between rooms; loaded from map_path when None
+
+		"""
+		self.name = name
+		self.game = Game(map_path, board)
+		self.clients = {}	# addr -> {'player': Player, 'last_active': float}
+		self.player_addrs = {}	# Player -> addr of the client playing it
+		self.watcher_addrs = set()
+		self.watcher_batch = None	# Prebuilt RecipientBatch for the watchers, None when they changed
+		self.is_cman_occupied = False
+		self.is_spirit_occupied = False
+		self.pending_moves = {player: deque() for player in MOVE_ORDER}	# (direction, seq) moves received since the last tick
+		self.input_acks = {}	# Player -> sequence number of the last of its moves the server consumed
+		self.unsent_acks = set()	# Players whose input ack changed since it was last sent
+		self.state_changed = False
+		self.last_update_time = time.monotonic()
+		self.ending = False	# The game ended and the winner is being announced
+		self.seq = 0	# Sequence number of the last state update sent, wraps at 2**16
+		self.last_state = None	# State the last update described, the base of the next delta
+		self.next_keyframe_time = 0.0	# time.monotonic() after which the next update is a full keyframe
+		self.keyframe_addrs = set()	# Clients that get a keyframe of their own on the next tick
+
+	def add_client(self, addr, player):
+		"""
+
+		Adds a client to the room.
+
+		Parameters:
+
+		addr (tuple(str, int)): the client's address
+
+		player (Player): the role the client plays, Player.NONE for a watcher
+
+		"""
+		self.clients[addr] = {'player': player, 'last_active': time.monotonic()}
+		self.keyframe_addrs.add(addr)
+		if player == Player.NONE:
+			self.watcher_addrs.add(addr)
+			self.watcher_batch = None
+		else:
+			self.player_addrs[player] = addr
+
+	def remove_client(self, addr):
+		"""
+
+		Removes a client from the room, if it is in it.
+
+		Parameters:
+
+		addr (tuple(str, int)): the client's address
+
+		"""
+		client = self.clients.pop(addr, None)
+		self.keyframe_addrs.discard(addr)
+		if client is None:
+			return
+		if client['player'] == Player.NONE:
+			self.watcher_addrs.discard(addr)
+			self.watcher_batch = None
+		elif self.player_addrs.get(client['player']) == addr:
+			del self.player_addrs[client['player']]
+
+	def clear_clients(self):
+		"""
+
+		Removes every client from the room.
+
+		"""
+		self.clients.clear()
+		self.keyframe_addrs.clear()
+		self.player_addrs.clear()
+		self.watcher_addrs.clear()
+		self.watcher_batch = None
+
+	def clear_pending_moves(self):
+		"""
+
+		Drops every move waiting for the next tick.
+
+		"""
+		for moves in self.pending_moves.values():
+			moves.clear()
+
+	def ack_input(self, player, seq):
+		"""
+
+		Records that a player's move was consumed, applied or not, so the next tick acknowledges it.
+
+		Parameters:
+
+		player (Player): the player that sent the move
+
+		seq (int): the move's input sequence number, None for moves sent without one
+
+		"""
+		if seq is None:
+			return
+		acked = self.input_acks.get(player)
+		if acked is not None and (seq - acked) & 0xFFFF >= 0x8000:
+			# Older than a move already acknowledged: acks only ever move forward
+			return
+		self.input_acks[player] = seq
+		self.unsent_acks.add(player)
+
+	def has_pending_moves(self):
+		"""
+
+		Returns:
+
+		bool: whether any player has a move waiting for the next tick
+
+		"""
+		return any(self.pending_moves.values())
+
+	def is_ending(self):
+		"""
+
+		Returns:
+
+		bool: whether the game ended and the room is announcing the winner
+
+		"""
+		return self.ending
@@ -0,0 +1,88 @@
+"""
+Timers for a single-threaded select loop, kept in a heap ordered by due time.
+
+Every timed event of the server (ticks, heartbeats, end-game steps, idle
+sweeps) is a timer here. The loop sleeps in select until the earliest timer
+is due or a packet arrives, then runs whatever is due:
+
+    scheduler = Scheduler()
+    scheduler.call_later(1.0, heartbeat)
+    while True:
+        select.select([sock], [], [], scheduler.timeout())
+        ...
+        scheduler.run_due()
+
+All times come from time.monotonic(), so wall-clock changes don't move them.
+"""
+
+import heapq
+import itertools
+import time
+
+
+class Timer:
+    __slots__ = ('due', 'callback', 'args', 'cancelled')
+
+    def __init__(self, due, callback, args):
+        self.due = due              # time.monotonic() at which the callback runs
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        # Left in the heap and skipped when it comes up, so cancelling costs nothing
+        self.cancelled = True
+
+
+class Scheduler:
+    def __init__(self):
+        self.heap = []  # (due, order, Timer); order keeps timers due together in scheduling order
+        self.order = itertools.count()
+
+    def call_at(self, due, callback, *args):
+        """
+
+        Runs callback(*args) from run_due once time.monotonic() reaches due.
+
+        Returns:
+
+        Timer: the timer, which can be cancelled
+
+        """
+        timer = Timer(due, callback, args)
+        heapq.heappush(self.heap, (due, next(self.order), timer))
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(time.monotonic() + max(delay, 0), callback, *args)
+
+    def timeout(self):
+        """
+
+        Returns:
+
+        float: seconds until the next timer is due (0 if one already is), None when there are no timers
+
+        """
+        heap = self.heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return max(heap[0][0] - time.monotonic(), 0)
+
+    def run_due(self):
+        """
+
+        Runs every timer due by now, earliest first. Timers the callbacks schedule
+        for now or earlier wait for the next call, so a timer can't starve the loop.
+
+        """
+        heap = self.heap
+        now = time.monotonic()
+        due = []
+        while heap and heap[0][0] <= now:
+            due.append(heapq.heappop(heap)[2])
+        for timer in due:
+            if not timer.cancelled:
+                timer.callback(*timer.args)
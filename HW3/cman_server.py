@@ -1,66 +1,244 @@
-import sys
 import socket
-import json
 import argparse
 import select
 import time
-from cman_game import Player, Direction, State, Game
+import struct
+from collections import OrderedDict
+from cman_game import Player, State, Board
+from cman_room import Room, MOVE_ORDER
+from cman_broadcast import RecipientBatch
+from cman_scheduler import Scheduler
+from cman_utils import MAX_ROOM_NAME_LENGTH
+from cman_reliable import ReliableSender, read_seq, SEQ
+from cman_log import setup_logging, get_logger
+from common.runtime_profiler import install_profiler  # cman_log puts common/ on the path
+
+log = get_logger('cman_server')
+
+# Handlers that can be timed on demand (SIGUSR2)
+PROFILED_HANDLERS = ['handle_message', 'handle_player_movement', 'publish_game_state_update_to_all', 'run_tick']
+
+# Simulation ticks per second, overridable with --tick-rate
+DEFAULT_TICK_RATE = 20
+# Seconds without a state change after which the state is sent again anyway
+HEARTBEAT_INTERVAL = 1.0
+# Moves a player may have waiting for the next tick; more are dropped
+MAX_QUEUED_MOVES = 8
+# Reliable control messages (cman_reliable): the client acks them with 0x04 + seq
+JOIN_ACCEPT_OPCODE = 0x83
+QUIT_ACK_OPCODE = 0x84
+WIN_OPCODE = 0x8F
+
+# Seconds without any message after which a client is evicted, overridable with --idle-timeout (0 disables)
+DEFAULT_IDLE_TIMEOUT = 30.0
+
+# Seconds between two full keyframes while deltas are being sent
+KEYFRAME_INTERVAL = 1.0
+# Bits of the delta field mask: which parts of the state a 0x81 update carries
+DELTA_CMAN = 0x01
+DELTA_SPIRIT = 0x02
+DELTA_SCORE = 0x04
+DELTA_POINTS = 0x08
+POINTS_BITS = 40
+# opcode, freeze, cman row/col, spirit row/col, spirit score, collected bitmap (high byte, low 4 bytes), seq
+KEYFRAME = struct.Struct('>8BIH')
+# opcode, freeze, seq, field mask; the changed fields follow
+DELTA_HEADER = struct.Struct('>BBHB')
+# Longest delta: both coordinates, the score and every point
+MAX_DELTA_SIZE = DELTA_HEADER.size + 2 + 2 + 1 + 1 + POINTS_BITS
+# Update packets are packed into these and sent before the next one is built, indexed by the freeze byte
+keyframe_buffers = (bytearray(KEYFRAME.size), bytearray(KEYFRAME.size))
+delta_buffers = (bytearray(MAX_DELTA_SIZE), bytearray(MAX_DELTA_SIZE))
+
+# Input acknowledgement: opcode, sequence number of the last move the server consumed
+INPUT_ACK = struct.Struct('>BH')
+INPUT_ACK_OPCODE = 0x82
+
+MAP_PATH = "map.txt"
+# The map, loaded once at startup and shared by the games of every room
+board = None
+
+# Every timed event: ticks, heartbeats, end-game steps and idle sweeps; its next deadline is the select timeout
+scheduler = Scheduler()
+tick_interval = 1.0 / DEFAULT_TICK_RATE
+tick_timer = None  # Pending tick, None while no room has work for one
+last_tick_time = 0.0
+heartbeat_timer = None  # Pending heartbeat, None while there are no rooms
+sweep_timer = None  # Pending idle sweep, None while there are no clients
+# Join accepts and win messages, retransmitted until acked
+reliable = None
+# Rooms by name, least recently updated first so heartbeats only look at the front
+rooms = OrderedDict()
+# Room of every joined client, so a packet finds its game in one lookup
+client_rooms = {}
+# Rooms with queued moves or state changes for the next tick
+dirty_rooms = set()
+# Last message time.monotonic() of every joined client, least recently active first so the sweeper only looks at the front
+client_activity = OrderedDict()
+idle_timeout = DEFAULT_IDLE_TIMEOUT
 
 def main():
-    global clients, is_cman_occupied, is_spirit_occupied, game, server_socket, last_update_time
-    clients = {}
-    is_cman_occupied = False
-    is_spirit_occupied = False
-    game = Game("map.txt")
+    global server_socket, idle_timeout, tick_interval, reliable, board
     
-    port = parse_command_line_args().port
-    print(f"Server will start on port {port}")
+    args = parse_command_line_args()
+    setup_logging(args.log_level)
+    # SIGUSR1 toggles the profiler, SIGUSR2 toggles handler timing
+    install_profiler(globals(), PROFILED_HANDLERS, args.profile_dir, 'cman_server', args.profile_mode)
+    log.info("server will start", port=args.port)
+    board = Board(MAP_PATH)
     
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    server_socket.bind(('localhost', port))
+    server_socket.bind(('localhost', args.port))
     server_socket.setblocking(False)  # Non-blocking socket
+    reliable = ReliableSender(server_socket, scheduler)
     
-    print("Server started")
+    log.info("server started")
     
-    last_update_time = time.time()
+    tick_interval = 1.0 / args.tick_rate
+    idle_timeout = args.idle_timeout
     
     try:
         while True:
-            update_client_game_state_periodically()
-            read_sockets, _, _ = select.select([server_socket], [], [], 0.1)
+            # Sleeps until a packet arrives or the next timer is due; without timers, until a packet arrives
+            read_sockets, _, _ = select.select([server_socket], [], [], scheduler.timeout())
             for sock in read_sockets:
                 data, addr = sock.recvfrom(1024)
-                data = data.decode()
+                # One character per byte, so binary fields such as move sequence numbers survive
+                data = data.decode('latin-1')
                 opcode = data[0]
                 message = data[1:]
                 handle_message(opcode, message, addr)
+
+            scheduler.run_due()
     except KeyboardInterrupt:
-        print("Server shutting down gracefully")
+        log.info("server shutting down gracefully")
         shutdown_server()
     
-def update_client_game_state_periodically():
-    global last_update_time
-    if time.time() - last_update_time > 1.0:
-        publish_game_state_update_to_all()
+def mark_dirty(room):
+    # The room has work for the next tick; ticks are only scheduled while some room does
+    global tick_timer
+    dirty_rooms.add(room)
+    if tick_timer is None:
+        # Ticks stay at least tick_interval apart, so moves arriving together are applied together
+        tick_timer = scheduler.call_at(max(last_tick_time + tick_interval, time.monotonic()), run_tick)
 
+def run_tick():
+    # Apply the moves queued during the tick and send one snapshot per room that changed
+    global tick_timer, last_tick_time
+    tick_timer = None
+    last_tick_time = time.monotonic()
+    for room in list(dirty_rooms):
+        if room.is_ending():
+            # The game is over: clients get the win message instead of state updates
+            continue
+        apply_pending_moves(room)
+        if room.is_ending():
+            # One of the moves ended the game and the win message is already out
+            continue
+        if room.state_changed:
+            publish_game_state_update_to_all(room)
+        if room.keyframe_addrs:
+            send_keyframes(room)
+        if room.unsent_acks:
+            send_input_acks(room)
+    dirty_rooms.clear()
 
+def apply_pending_moves(room):
+    # One move per player per round, CMAN before SPIRIT, until the queues are empty
+    game = room.game
+    while room.has_pending_moves():
+        for player in MOVE_ORDER:
+            moves = room.pending_moves[player]
+            if not moves:
+                continue
+            direction, seq = moves.popleft()
+            if game.apply_move(player, direction):
+                room.state_changed = True
+            room.ack_input(player, seq)
+            if game.get_winner() != Player.NONE:
+                room.clear_pending_moves()
+                handle_end_game(room)
+                return
 
+def heartbeat():
+    # Rooms are ordered by their last update, so only the stale ones at the front are visited
+    global heartbeat_timer
+    heartbeat_timer = None
+    now = time.monotonic()
+    while rooms:
+        room = next(iter(rooms.values()))
+        if now - room.last_update_time < HEARTBEAT_INTERVAL:
+            break
+        if room.is_ending():
+            room.last_update_time = now
+            rooms.move_to_end(room.name)
+        else:
+            publish_game_state_update_to_all(room, keyframe=True)
+    schedule_heartbeat()
+
+def schedule_heartbeat():
+    # Due when the least recently updated room goes stale; rooms updated meanwhile just push it back
+    global heartbeat_timer
+    if heartbeat_timer is None and rooms:
+        room = next(iter(rooms.values()))
+        heartbeat_timer = scheduler.call_at(room.last_update_time + HEARTBEAT_INTERVAL, heartbeat)
+
+def get_or_create_room(name):
+    room = rooms.get(name)
+    if room is None:
+        room = Room(name, MAP_PATH, board)
+        rooms[name] = room
+        log.debug("room created", room=name, rooms=len(rooms))
+        schedule_heartbeat()
+    return room
+
+def remove_client(room, addr):
+    room.remove_client(addr)
+    client_rooms.pop(addr, None)
+    client_activity.pop(addr, None)
+    reliable.forget(addr)
+    if not room.clients and not room.is_ending():
+        close_room(room)
+
+def close_room(room):
+    for addr in room.clients:
+        client_rooms.pop(addr, None)
+        client_activity.pop(addr, None)
+        reliable.forget(addr)
+    room.clear_clients()
+    rooms.pop(room.name, None)
+    dirty_rooms.discard(room)
+    log.debug("room closed", room=room.name, rooms=len(rooms))
 
 def shutdown_server():
-    print("Notifying clients about server shutdown...")
-    for client_addr in clients.keys():
+    log.info("notifying clients about server shutdown", clients=len(client_rooms), rooms=len(rooms))
+    for client_addr in client_rooms.keys():
         try:
             server_socket.sendto(b'\xFFServer is shutting down.', client_addr)
         except BlockingIOError:
-            print(f"Failed to notify {client_addr}: socket buffer is full")
+            log.warning("failed to notify client: socket buffer is full", addr=client_addr)
     
-    clients.clear()
+    client_rooms.clear()
+    client_activity.clear()
+    rooms.clear()
     server_socket.close()
-    print("Server socket closed. Goodbye!")
+    log.info("server socket closed")
 
 def parse_command_line_args():
     parser = argparse.ArgumentParser(description="Cman Game Server")
     parser.add_argument("-p", "--port", type=int, default=1337, help="Server port (default: 1337).")
+    parser.add_argument("--tick-rate", type=float, default=DEFAULT_TICK_RATE,
+                        help=f"Simulation ticks per second; at most one state update is sent per tick "
+                             f"(default: {DEFAULT_TICK_RATE}).")
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help=f"Seconds without any message after which a client is dropped; an idle player "
+                             f"forfeits the game. 0 disables (default: {DEFAULT_IDLE_TIMEOUT:g}).")
+    parser.add_argument("--profile-dir", default=".",
+                        help="Directory for profiles written on SIGUSR1/SIGUSR2 (default: current directory).")
+    parser.add_argument("--profile-mode", default="cprofile", choices=["cprofile", "sample"],
+                        help="cprofile for deterministic profiles, sample for flamegraph-ready stack samples.")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Minimum level of log records to write (default: INFO).")
     args = parser.parse_args()
     return args
 
@@ -68,28 +246,45 @@ def parse_command_line_args():
 
 
 def handle_message(opcode, message, addr):
-    if addr in clients: # Don't update last_active for unknown clients
-        clients[addr]['last_active'] = time.time()
+    room = client_rooms.get(addr)
+    if room is not None: # Don't update last_active for unknown clients
+        now = time.monotonic()
+        room.clients[addr]['last_active'] = now
+        client_activity[addr] = now
+        client_activity.move_to_end(addr)
     if opcode == '\x00':  # 0x00: Join
         handle_join(message, addr)
     elif opcode == '\x01':  # 0x01: Player movement
         handle_player_movement(message, addr)
+    elif opcode == '\x02':  # 0x02: Keyframe request
+        handle_keyframe_request(message, addr)
+    elif opcode == '\x03':  # 0x03: Keepalive
+        handle_keepalive(message, addr)
+    elif opcode == '\x04':  # 0x04: Ack of a reliable message
+        handle_ack(message, addr)
     elif opcode == '\x0F':  # 0x0F: Quit
         handle_quit(message, addr)
 
 def handle_join(message, addr):
-    global is_cman_occupied, is_spirit_occupied
-    if len(message) != 1:
+    # The role byte may be followed by the name of the room to join; no name joins the default room
+    if len(message) < 1 or len(message) > 1 + MAX_ROOM_NAME_LENGTH:
         publish_error(addr, "1") # Invalid join message
         return
-    if addr in clients.keys():
+    if addr in client_rooms:
+        if is_repeated_join(message, addr):
+            # The client didn't get its join accept yet, which is still being retransmitted
+            return
         publish_error(addr, "2") # User already joined
         return
     role = message[0]
+    if role not in ('\x00', '\x01', '\x02'):
+        publish_error(addr,"6") # Cant join -  Invalid role
+        return
+    room = get_or_create_room(message[1:])
+    game = room.game
     
     if role == '\x00':
-        clients[addr] = {'player': Player.NONE, 'last_active': time.time()}
-        publish_game_state_update_to_all()
+        add_client(room, addr, Player.NONE)
         return
     
     if game.state != State.WAIT:
@@ -97,145 +292,356 @@ def handle_join(message, addr):
         return
 
     if role == '\x01':
-        if is_cman_occupied:
+        if room.is_cman_occupied:
             publish_error(addr, "4"); # Cman cant join - already occupied
             return
-        clients[addr] = {'player': Player.CMAN, 'last_active': time.time()}
-        is_cman_occupied = True
-        if is_spirit_occupied:
+        add_client(room, addr, Player.CMAN)
+        room.is_cman_occupied = True
+        if room.is_spirit_occupied:
             game.next_round()
-        publish_game_state_update_to_all()
     elif role == '\x02':
-        if is_spirit_occupied:
+        if room.is_spirit_occupied:
             publish_error(addr, "5"); # Spirit cant join - already occupied
             return
-        clients[addr] = {'player': Player.SPIRIT, 'last_active': time.time()}
-        is_spirit_occupied = True
-        if is_cman_occupied:
+        add_client(room, addr, Player.SPIRIT)
+        room.is_spirit_occupied = True
+        if room.is_cman_occupied:
             game.next_round()
-        publish_game_state_update_to_all()
-    else:
-        publish_error(addr,"6") # Cant join -  Invalid role
-
-
-def calculate_collected_points():
-    points = game.get_points()
-    collected_points = ''
 
-    # Build the binary string
-    for point in sorted(points.keys()):
-        collected_points += str(flip(points[point]))
+def is_repeated_join(message, addr):
+    room = client_rooms[addr]
+    player = room.clients[addr]['player']
+    return message[1:] == room.name and message[:1] == chr(player + 1)
 
-    # Ensure exactly 40 bits
-    collected_points = collected_points.ljust(40, '0')[:40]
+def add_client(room, addr, player):
+    # Room.add_client queues a keyframe for the new client, the join accept tells it which role it got
+    room.add_client(addr, player)
+    reliable.send([addr], bytes([JOIN_ACCEPT_OPCODE, player + 1]))
+    if room.is_ending():
+        # Joined a finished game: it still gets the result before the room closes
+        send_win_message(room, [addr])
+    client_rooms[addr] = room
+    client_activity[addr] = room.clients[addr]['last_active']
+    schedule_sweep()
+    mark_state_changed(room)
 
-    # Convert binary string to 5 bytes
-    return int(collected_points, 2).to_bytes(5, byteorder='big')
+def mark_state_changed(room):
+    # The next tick sends the new state to everyone in the room
+    room.state_changed = True
+    mark_dirty(room)
 
-def flip(bit):
-    return 1 if bit == 0 else 0
 def handle_player_movement(message, addr): 
-    if addr not in clients:
+    room = client_rooms.get(addr)
+    if room is None:
         publish_error(addr,"7"); # movement detected from an unknown user
         return
-    if len(message) != 1:
+    # The direction may be followed by the client's 2-byte input sequence number, acknowledged with 0x82
+    if len(message) not in (1, 3):
         publish_error(addr, "8"); # Invalid movement message
         return
     direction = message[0]
+    seq = (ord(message[1]) << 8 | ord(message[2])) if len(message) == 3 else None
     if direction not in ['\x00', '\x01', '\x02', '\x03']:
         publish_error(addr, "9") #Invalid direction in movement message
         return
-    if clients[addr]['player'] == Player.NONE:
+    player = room.clients[addr]['player']
+    if player == Player.NONE:
         publish_error(addr, "10")  # Watcher can't move
         return
     
-    direction = int.from_bytes(direction.encode(), byteorder='big')
-    if not game.can_move(clients[addr]['player']):
+    direction = ord(direction)
+    if not room.game.can_move(player):
 	    publish_error(addr, "0") # this player cannot move in this state of the game
+	    reject_input(room, player, seq)
 	    return False
-    game.apply_move(clients[addr]['player'], direction)
-    
-    if game.get_winner() != Player.NONE:
-        handle_end_game()
-    publish_game_state_update_to_all()
-
-def publish_game_state_update_to_all():
-    global last_update_time
-    last_update_time = time.time() 
-    opcode = b'\x80'
-    cman_cor = bytes(game.cur_coords[Player.CMAN])
-    spirit_cor = bytes(game.cur_coords[Player.SPIRIT])
-    spirit_score = (3 - game.get_game_progress()[0]).to_bytes(1, byteorder='big')
-    collected_points = calculate_collected_points()
-    for client_addr in clients.keys():
-        player = clients[client_addr]['player']
-        freeze = calc_freeze(player)
+    # Applied on the next tick, together with the other player's moves
+    moves = room.pending_moves[player]
+    if len(moves) >= MAX_QUEUED_MOVES:
+        log.debug("dropping move: too many queued", sample=100, addr=addr)
+        reject_input(room, player, seq)
+        return False
+    moves.append((direction, seq))
+    mark_dirty(room)
+
+def reject_input(room, player, seq):
+    # A move that will never be applied is acknowledged too, so the client stops predicting it.
+    # With older moves still queued, the ack rides on the last of them: acks go out in order,
+    # and the client keeps predicting those moves until they are applied
+    moves = room.pending_moves[player]
+    if seq is not None and moves:
+        moves[-1] = (moves[-1][0], seq)
+    else:
+        room.ack_input(player, seq)
+    mark_dirty(room)
+
+def send_input_acks(room):
+    # Sent after the tick's state update, so a client drops its predicted moves only once
+    # the state that includes them is on its way
+    for player in room.unsent_acks:
+        client_addr = room.player_addrs.get(player)
+        if client_addr is None:
+            continue
         try:
-            message = opcode + freeze + cman_cor + spirit_cor + spirit_score + collected_points
-            server_socket.sendto(message, client_addr)
+            server_socket.sendto(INPUT_ACK.pack(INPUT_ACK_OPCODE, room.input_acks[player]), client_addr)
         except BlockingIOError:
-            print(f"Failed to send game state update to {client_addr}: socket buffer is full")
-def calc_freeze(player):
+            log.warning("failed to send input ack: socket buffer is full", sample=100, addr=client_addr)
+    room.unsent_acks.clear()
+
+def publish_game_state_update_to_all(room, keyframe=False):
+    # Sends the next sequence numbered update: a delta (0x81) against the previous update, or
+    # a full keyframe (0x80) periodically, on heartbeats and when a delta can't describe the change.
+    # The packet only differs in the freeze byte, so it is built once per variant:
+    # watchers always get the frozen one, each player the one matching can_move
+    game = room.game
+    now = time.monotonic()
+    room.last_update_time = now
+    room.state_changed = False
+    rooms.move_to_end(room.name)
+    room.seq = (room.seq + 1) & 0xFFFF
+    state = game_state(game)
+    fields = None
+    if not keyframe and room.last_state is not None and now < room.next_keyframe_time:
+        fields = build_delta(room.last_state, state)
+    room.last_state = state
+    if fields is None:
+        room.next_keyframe_time = now + KEYFRAME_INTERVAL
+        # Everyone gets this keyframe, no need for extra ones
+        room.keyframe_addrs.clear()
+        frozen = pack_keyframe(1, state, room.seq)
+        active = pack_keyframe(0, state, room.seq)
+    else:
+        frozen = pack_delta(1, room.seq, fields)
+        active = pack_delta(0, room.seq, fields)
+    failed = send_to_watchers(room, frozen)
+    for player, client_addr in room.player_addrs.items():
+        try:
+            server_socket.sendto(active if game.can_move(player) else frozen, client_addr)
+        except BlockingIOError:
+            failed += 1
+    if failed:
+        log.warning("failed to send game state update: socket buffer is full", sample=100,
+                    room=room.name, failed=failed)
+
+def game_state(game):
+    # (cman row, cman column, spirit row, spirit column, spirit score, collected points bitmap)
+    (cman_row, cman_col), (spirit_row, spirit_col) = game.cur_coords[Player.CMAN], game.cur_coords[Player.SPIRIT]
+    return (cman_row, cman_col, spirit_row, spirit_col, 3 - game.get_game_progress()[0], game.get_collected_mask())
+
+def pack_keyframe(freeze, state, seq):
+    buffer = keyframe_buffers[freeze]
+    collected = state[5]
+    KEYFRAME.pack_into(buffer, 0, 0x80, freeze, *state[:5], collected >> 32, collected & 0xFFFFFFFF, seq)
+    return buffer
+
+def pack_delta(freeze, seq, fields):
+    buffer = delta_buffers[freeze]
+    DELTA_HEADER.pack_into(buffer, 0, 0x81, freeze, seq, fields[0])
+    end = DELTA_HEADER.size + len(fields) - 1
+    buffer[DELTA_HEADER.size:end] = fields[1:]
+    return memoryview(buffer)[:end]
+
+def build_delta(previous, state):
+    # Field mask followed by the fields that changed. Newly collected points are sent as a count
+    # and their bit indices (0 = first point, the bitmap's most significant bit).
+    # None when the change can't be expressed, e.g. points that were un-collected.
+    mask = 0
+    fields = []
+    if state[0:2] != previous[0:2]:
+        mask |= DELTA_CMAN
+        fields += state[0:2]
+    if state[2:4] != previous[2:4]:
+        mask |= DELTA_SPIRIT
+        fields += state[2:4]
+    if state[4] != previous[4]:
+        mask |= DELTA_SCORE
+        fields.append(state[4])
+    if state[5] != previous[5]:
+        if previous[5] & ~state[5]:
+            return None
+        collected = state[5] & ~previous[5]
+        indices = []
+        while collected:
+            lowest = collected & -collected
+            indices.append(POINTS_BITS - lowest.bit_length())
+            collected ^= lowest
+        mask |= DELTA_POINTS
+        fields.append(len(indices))
+        fields += indices
+    return bytes([mask] + fields)
+
+def send_keyframes(room):
+    # A keyframe of the current state, with the current sequence number, just for the
+    # clients that joined or asked for one
+    state = room.last_state if room.last_state is not None else game_state(room.game)
+    for client_addr in room.keyframe_addrs:
+        freeze = calc_freeze(room.game, room.clients[client_addr]['player'])
+        try:
+            server_socket.sendto(pack_keyframe(freeze, state, room.seq), client_addr)
+        except BlockingIOError:
+            log.warning("failed to send keyframe: socket buffer is full", sample=100, addr=client_addr)
+    room.keyframe_addrs.clear()
+
+def calc_freeze(game, player):
     if player == Player.NONE:
-        return b'\x01'
+        return 1
     else:
         if game.can_move(player):
-            return b'\x00'
+            return 0
+        else:
+            return 1
+
+def send_to_watchers(room, packet):
+    # One batched send to every watcher; returns how many it couldn't be sent to
+    if not room.watcher_addrs:
+        return 0
+    if room.watcher_batch is None:
+        room.watcher_batch = RecipientBatch(server_socket, room.watcher_addrs)
+    return room.watcher_batch.send(packet)
+
+def handle_keyframe_request(message, addr):
+    # A client saw a gap in the update sequence; it gets a keyframe on the next tick
+    room = client_rooms.get(addr)
+    if room is None:
+        publish_error(addr, "13") # Keyframe request from an unknown user
+        return
+    if len(message) != 0:
+        publish_error(addr, "14") # Invalid keyframe request: should be only opcode
+        return
+    room.keyframe_addrs.add(addr)
+    mark_dirty(room)
+
+def handle_keepalive(message, addr):
+    # Nothing to do: handle_message already recorded the client as active
+    if addr not in client_rooms:
+        publish_error(addr, "15") # Keepalive from an unknown user
+        return
+    if len(message) != 0:
+        publish_error(addr, "16") # Invalid keepalive message: should be only opcode
+
+def sweep_idle_clients():
+    # Clients are ordered by their last message, so only the idle ones at the front are visited
+    global sweep_timer
+    sweep_timer = None
+    now = time.monotonic()
+    while client_activity:
+        addr, last_active = next(iter(client_activity.items()))
+        if now - last_active < idle_timeout:
+            break
+        evict_idle_client(addr)
+    schedule_sweep()
+
+def schedule_sweep():
+    # Due when the least recently active client would become idle
+    global sweep_timer
+    if sweep_timer is None and client_activity and idle_timeout > 0:
+        last_active = next(iter(client_activity.values()))
+        sweep_timer = scheduler.call_at(last_active + idle_timeout, sweep_idle_clients)
+
+def evict_idle_client(addr):
+    client_activity.pop(addr, None)
+    room = client_rooms.get(addr)
+    if room is None:
+        return
+    player = room.clients[addr]['player']
+    log.info("evicting idle client", addr=addr, room=room.name, player=player)
+    publish_error(addr, "17") # Disconnected: idle for too long
+    if player != Player.NONE and not room.is_ending():
+        if room.game.state == State.WAIT:
+            # No game to forfeit yet: just free the role for someone else
+            if player == Player.CMAN:
+                room.is_cman_occupied = False
+            else:
+                room.is_spirit_occupied = False
         else:
-            return b'\x01'
+            # Same as a quit: the opponent wins
+            forfeit(room, player)
+    remove_client(room, addr)
+
+def forfeit(room, player):
+    if player == Player.CMAN:
+        room.is_cman_occupied = False
+        room.game.declare_winner(Player.SPIRIT)
+        handle_end_game(room)
+    elif player == Player.SPIRIT:
+        room.is_spirit_occupied = False
+        room.game.declare_winner(Player.CMAN)
+        handle_end_game(room)
+
+def handle_ack(message, addr):
+    if len(message) != SEQ.size:
+        publish_error(addr, "18") # Invalid ack message: should be opcode and sequence number
+        return
+    # Acks come from clients that already left too, e.g. for the win message
+    reliable.ack(addr, read_seq(message.encode('latin-1')))
 
 def handle_quit(message, addr):
-    print(f"Player from {addr} wants to quit")
-    if addr not in clients:
+    # The opcode may be followed by a sequence number: the client repeats its quit until a 0x84 ack with it arrives
+    log.info("player wants to quit", addr=addr)
+    if len(message) not in (0, SEQ.size):
+        publish_error(addr, "12") # Invalid quit message: should be only opcode and an optional sequence number
+        return
+    room = client_rooms.get(addr)
+    if len(message) == SEQ.size:
+        try:
+            server_socket.sendto(bytes([QUIT_ACK_OPCODE]) + message.encode('latin-1'), addr)
+        except BlockingIOError:
+            log.warning("failed to send quit ack: socket buffer is full", sample=100, addr=addr)
+        if room is None:
+            # A repeated quit whose ack was lost: it was handled already
+            return
+    if room is None:
         publish_error(addr, "11") # Quit message or timedout from unknown user
         return
-    if len(message) != 0:
-        publish_error(addr, "12") # Invalid quit message: should be only opcode
-        return
-    if clients[addr]['player'] == Player.CMAN:
-        global is_cman_occupied
-        is_cman_occupied = False
-        game.declare_winner(Player.SPIRIT)
-        handle_end_game()
-    elif clients[addr]['player'] == Player.SPIRIT:
-        global is_spirit_occupied
-        is_spirit_occupied = False
-        game.declare_winner(Player.CMAN)
-        handle_end_game()
-    if addr in clients:
-        clients.pop(addr)
-
-def handle_end_game():
-    global is_cman_occupied, is_spirit_occupied
+    forfeit(room, room.clients[addr]['player'])
+    remove_client(room, addr)
+
+def handle_end_game(room):
+    # Announce the winner until every client acked it, then restart; packets are still served meanwhile
+    if room.is_ending():
+        return
+    room.ending = True
+    room.clear_pending_moves()
+    send_win_message(room, on_done=lambda: restart_game(room))
+
+def restart_game(room):
+    # Everyone leaves the finished game; the room is created again by the next join
+    room.ending = False
+    if rooms.get(room.name) is room:
+        close_room(room)
+    log.info("game restarted", room=room.name)
+
+def send_win_message(room, addrs=None, on_done=None):
+    # Reliable: the first copy is batched like a state update, retransmissions go to whoever didn't ack
+    game = room.game
     winner = game.get_winner()
-    start_time = time.time()
-    while time.time() - start_time < 10:
-        send_win_message(winner)
-        time.sleep(1)
-    game.restart_game()
-    is_cman_occupied = False
-    is_spirit_occupied = False
-    clients.clear()
-
-def send_win_message(winner):
     winner_in_bytes = b'\x01' if winner == Player.CMAN else b'\x02'
     spirit_score = (3 - game.get_game_progress()[0]).to_bytes(1, byteorder='big')
     cman_score = (game.get_game_progress()[1]).to_bytes(1, byteorder='big')
-    for client_addr in clients.keys():
-        try:
-            message = b'\x8F' + winner_in_bytes + spirit_score + cman_score
-            server_socket.sendto(message, client_addr)
-            print(f"Sending win! message to {client_addr}: {message}")
-        except BlockingIOError:
-            print(f"Failed to send win message to {client_addr}: socket buffer is full")
+    message = bytes([WIN_OPCODE]) + winner_in_bytes + spirit_score + cman_score
+    if addrs is not None:
+        reliable.send(addrs, message, on_done=on_done)
+        return
+
+    def first_send(packet):
+        failed = send_to_watchers(room, packet)
+        for client_addr in room.player_addrs.values():
+            try:
+                server_socket.sendto(packet, client_addr)
+            except BlockingIOError:
+                failed += 1
+        if failed:
+            log.warning("failed to send win message: socket buffer is full", room=room.name, failed=failed)
+
+    reliable.send(room.clients.keys(), message, first_send=first_send, on_done=on_done)
+    log.debug("sending win message", room=room.name, clients=len(room.clients), message=message)
 
 def publish_error(addr, message):
     try:
         message = b'\xFF' + message.encode().ljust(11, b'\x00')
         server_socket.sendto(message, addr)
-        print(f"Sending error message to {addr}: {message}")
+        log.debug("sending error message", sample=100, addr=addr, message=message)
     except BlockingIOError:
-        print(f"Failed to send error message to {addr}: socket buffer is full")
+        log.warning("failed to send error message: socket buffer is full", sample=100, addr=addr)
 
 if __name__ == "__main__":
     main()
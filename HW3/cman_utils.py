@@ -1,7 +1,8 @@
 import sys
-import pynput, time
 from queue import Queue
-from pynput import keyboard
+
+# Longest room name a join message may carry
+MAX_ROOM_NAME_LENGTH = 32
 
 pressed_keys = Queue()
 
@@ -48,6 +49,8 @@ def key_listener(keys_filter=None):
                     pressed_keys.put(char)
         except AttributeError:
             pass  # Handle special keys if necessary
+    # Imported here so the server can share this module without needing pynput
+    from pynput import keyboard
     _flush_input()
     with keyboard.Listener(on_press=on_press) as listener:
         listener.join()  # Keep the listener running
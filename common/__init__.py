@@ -0,0 +1,4 @@
+"""
+Modules shared by the homework servers. Each homework reaches them through a
+small module of its own that puts the repository root on sys.path.
+"""
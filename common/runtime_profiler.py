@@ -0,0 +1,161 @@
+"""
+On-demand profiling for a live server, used by both the HW1 numbers server
+and the HW3 cman server. Each server passes its own name as the prefix of the
+files written.
+
+Nothing is installed while profiling is off: no profiler hook, no timer and
+no wrapped functions, so the server runs at full speed until asked.
+
+  SIGUSR1  start / stop the profiler. On stop the results are written to the
+           output directory: a .prof pstats file in 'cprofile' mode, or a
+           .folded file (one "frame;frame;frame count" line per stack, the
+           input format of flamegraph.pl and speedscope) in 'sample' mode.
+  SIGUSR2  start / stop timing of the selected handlers. On stop a
+           .handlers.txt file with call count, total, mean and max is written.
+
+Usage:
+    install_profiler(globals(), ['handle_read', 'handle_write'], '/tmp', 'numbers_server', 'sample')
+    kill -USR1 <pid>
+"""
+
+import os
+import sys
+import time
+import signal
+import cProfile
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005  # Seconds of CPU time between stack samples
+
+
+class RuntimeProfiler:
+    def __init__(self, namespace, handler_names, output_dir, prefix, mode='cprofile'):
+        """
+
+        Parameters:
+
+        namespace (dict): module globals holding the handlers to time
+
+        handler_names (list(str)): names of the functions in namespace that can be timed
+
+        output_dir (str): directory the result files are written to
+
+        prefix (str): start of the result file names and of the messages on stderr, e.g. the server's name
+
+        mode (str): 'cprofile' for deterministic profiling, 'sample' for a low-overhead stack sampler
+
+        """
+        self.namespace = namespace
+        self.handler_names = handler_names
+        self.output_dir = output_dir
+        self.mode = mode
+        self.prefix = prefix
+        self.profile = None
+        self.samples = None
+        self.originals = None
+        self.timings = None
+
+    # ---- Whole-process profiler ----
+
+    def toggle_profiler(self, signum=None, frame=None):
+        if self.profile is None and self.samples is None:
+            self.start_profiler()
+        else:
+            self.stop_profiler()
+
+    def start_profiler(self):
+        if self.mode == 'sample':
+            self.samples = Counter()
+            signal.signal(signal.SIGPROF, self.take_sample)
+            signal.setitimer(signal.ITIMER_PROF, SAMPLE_INTERVAL, SAMPLE_INTERVAL)
+        else:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop_profiler(self):
+        if self.samples is not None:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+            path = self.output_path('folded')
+            with open(path, 'w') as f:
+                for stack, count in self.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            self.samples = None
+        else:
+            self.profile.disable()
+            path = self.output_path('prof')
+            self.profile.dump_stats(path)
+            self.profile = None
+        self.report(f"profile written to {path}")
+
+    def take_sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.samples[';'.join(reversed(stack))] += 1
+
+    # ---- Handler timing ----
+
+    def toggle_handler_timing(self, signum=None, frame=None):
+        if self.originals is None:
+            self.start_handler_timing()
+        else:
+            self.stop_handler_timing()
+
+    def start_handler_timing(self):
+        self.timings = {name: [0, 0.0, 0.0] for name in self.handler_names}
+        self.originals = {name: self.namespace[name] for name in self.handler_names}
+        for name, function in self.originals.items():
+            self.namespace[name] = self.timed(name, function)
+
+    def stop_handler_timing(self):
+        # Put the original functions back so timing costs nothing once it's off
+        self.namespace.update(self.originals)
+        self.originals = None
+        path = self.output_path('handlers.txt')
+        with open(path, 'w') as f:
+            f.write(f"{'handler':<40} {'calls':>10} {'total_s':>12} {'mean_us':>12} {'max_us':>12}\n")
+            for name, (calls, total, worst) in self.timings.items():
+                mean = total / calls if calls else 0.0
+                f.write(f"{name:<40} {calls:>10} {total:>12.6f} {mean * 1e6:>12.1f} {worst * 1e6:>12.1f}\n")
+        self.timings = None
+        self.report(f"handler timings written to {path}")
+
+    def timed(self, name, function):
+        stats = self.timings[name]
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+        return wrapper
+
+    # ---- Helpers ----
+
+    def output_path(self, extension):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        return os.path.join(self.output_dir, f"{self.prefix}-{os.getpid()}-{stamp}.{extension}")
+
+    def report(self, message):
+        # Runs inside a signal handler: write directly instead of going through the log queue lock
+        sys.stderr.write(f"{self.prefix}: {message}\n")
+
+
+def install_profiler(namespace, handler_names, output_dir, prefix, mode='cprofile'):
+    """
+
+    Creates a RuntimeProfiler and binds SIGUSR1 (profiler) and SIGUSR2 (handler timing) to it.
+
+    """
+    profiler = RuntimeProfiler(namespace, handler_names, output_dir, prefix, mode)
+    signal.signal(signal.SIGUSR1, profiler.toggle_profiler)
+    signal.signal(signal.SIGUSR2, profiler.toggle_handler_timing)
+    return profiler
@@ -0,0 +1,144 @@
+"""
+Structured, non-blocking logging shared by the HW1 numbers server and the
+HW3 cman server. Each homework imports it through its own small module
+(numbers_log, cman_log), which adds this directory's parent to sys.path.
+
+Log calls on the event loop only build a record and push it onto a bounded
+queue; a background thread does the formatting and the (possibly slow) write
+to stdout. When the queue is full records are dropped and counted instead of
+blocking the caller. High-frequency events can be sampled so only one in N
+of them is recorded.
+
+Usage:
+    setup_logging('INFO')
+    log = get_logger('some_server')
+    log.info("client joined", addr=addr)
+    log.debug("bad request", sample=100, data=data)
+"""
+
+import sys
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+
+DEFAULT_QUEUE_SIZE = 10000
+
+_listener = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """ Formats records as: time level logger event key=value ... """
+
+    def format(self, record):
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+        line = f"{timestamp}.{int(record.msecs):03d} {record.levelname:<7} {record.name} {record.getMessage()}"
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={format_value(value)}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def format_value(value):
+    text = str(value)
+    if not text or any(char in text for char in ' ="\n'):
+        return repr(text)
+    return text
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler that never blocks: full queue means the record is dropped """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the writer thread, not here
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredLogger:
+    """ Thin wrapper around logging.Logger taking an event name plus key=value fields """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.sample_counts = {}
+
+    def log(self, level, event, sample=None, exc_info=None, **fields):
+        # Disabled levels cost a single comparison
+        if not self.logger.isEnabledFor(level):
+            return
+        if sample and sample > 1:
+            count = self.sample_counts.get(event, 0)
+            self.sample_counts[event] = count + 1
+            if count % sample:
+                return
+            fields['sampled'] = f"1/{sample}"
+        self.logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+
+def get_logger(name):
+    return StructuredLogger(logging.getLogger(name))
+
+
+def setup_logging(level='INFO', stream=None, queue_size=DEFAULT_QUEUE_SIZE, formatter=None):
+    """
+
+    Routes all logging through a bounded queue drained by a background writer thread.
+
+    Parameters:
+
+    level (str): minimum level to record (DEBUG, INFO, WARNING, ERROR)
+
+    stream (file): where the writer thread writes records (default: stdout)
+
+    queue_size (int): records buffered before new ones are dropped
+
+    formatter (logging.Formatter): formats records on the writer thread (default: StructuredFormatter)
+
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(formatter or StructuredFormatter())
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    root = logging.getLogger()
+    root.handlers[:] = [DroppingQueueHandler(log_queue)]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    _listener = logging.handlers.QueueListener(log_queue, writer)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    # Flush whatever is still queued and stop the writer thread
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None